@@ -114,6 +114,7 @@ class Application(Frame, object):
             self.host, self.port, self.timeout, self.username, self.password = None, None, None, None, None
         self.player_idx = None
         self.posts = {}
+        self.post_points = {}
         self.trains = {}
         self.select_game_window = False
         self.available_games = None
@@ -173,7 +174,6 @@ class Application(Frame, object):
 
         self.pack(fill=BOTH, expand=True)
         self.requests_executor()
-        self.get_available_games()
         self.set_status_bar('Click Play to start the game')
         self.play.place(rely=0.5, relx=0.5, anchor=CENTER)
 
@@ -329,7 +329,7 @@ class Application(Frame, object):
         if path:
             if self.bot_thread:
                 self.bot_control()
-            self.posts, self.trains = {}, {}
+            self.posts, self.post_points, self.trains = {}, {}, {}
             self.source = path.name
             self.weighted_check.configure(state=NORMAL)
             self.build_map()
@@ -341,7 +341,9 @@ class Application(Frame, object):
     def select_game(self):
         """Opens select game window."""
         self.select_game_window = True
+        self.get_available_games()
         SelectGame(self, title='Select game')
+        self.bot.stop_available_games()
         self.select_game_window = False
         self.set_status_bar('Click Play to start the game')
 
@@ -349,6 +351,7 @@ class Application(Frame, object):
         """Closes application and stops bot if its started."""
         if self.bot_thread:
             self.bot_control()
+        self.bot.close()
         self.master.destroy()
 
     def bot_control(self):
@@ -370,10 +373,8 @@ class Application(Frame, object):
             self.bot_thread = None
 
     def get_available_games(self):
-        """Requests a list of available games."""
-        if self.select_game_window:
-            self.bot.get_available_games(host=self.host, port=self.port, time_out=self.timeout)
-        self.after(1000, self.get_available_games)
+        """Subscribes to the list of available games kept up to date by the bot lobby watcher in background."""
+        self.bot.get_available_games(host=self.host, port=self.port, time_out=self.timeout)
 
     def set_available_games(self, games):
         """Sets new value for available games list."""
@@ -391,7 +392,7 @@ class Application(Frame, object):
     def build_map(self, source=None):
         """Builds and draws new map.
 
-        :param source: string - source string; could be JSON string or path to *.json file.
+        :param source: string or dict - source; could be JSON string, path to *.json file or decoded static objects
         :return: None
         """
         if source:
@@ -561,16 +562,25 @@ class Application(Frame, object):
                 self.play.place(rely=0.5, relx=0.5, anchor=CENTER)
         self.after(50, self.requests_executor)
 
-    def refresh_map(self, dynamic_objects):
-        """Refreshes map with passed dynamic objects.
+    def refresh_map(self, delta):
+        """Refreshes map with passed changes of dynamic objects.
 
-        :param dynamic_objects: dict - dict of dynamic objects
+        :param delta: dict - changes of dynamic objects computed by client.DynamicLayer
         :return: None
         """
-        for post in dynamic_objects['posts']:
-            self.posts[post['point_idx']] = post
-        for train in dynamic_objects['trains']:
-            self.trains[train['idx']] = train
+        for post in delta['posts']['added'].values():
+            self.posts[post['point_idx']] = dict(post)
+            self.post_points[post['idx']] = post['point_idx']
+        for idx, fields in delta['posts']['changed'].items():
+            self.posts[self.post_points[idx]].update(fields)
+        for idx in delta['posts']['removed']:
+            self.posts.pop(self.post_points.pop(idx), None)
+        for train in delta['trains']['added'].values():
+            self.trains[train['idx']] = dict(train)
+        for idx, fields in delta['trains']['changed'].items():
+            self.trains[idx].update(fields)
+        for idx in delta['trains']['removed']:
+            self.trains.pop(idx, None)
         self.redraw_points()
         self.redraw_trains()
 
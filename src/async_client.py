@@ -0,0 +1,528 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""The module implements non-blocking client driven by a select based event loop.
+
+Python 2.7 has no asyncio, so requests return Future instances and coroutines are generators yielding them:
+
+    def session(client):
+        player = yield client.login()
+        dynamic_objects = yield client.get_dynamic_objects(deadline=time() + 1)
+        raise Return(dynamic_objects)
+
+    loop = EventLoop()
+    result = loop.run_until_complete(loop.spawn(session(AsyncClient(host, port, loop=loop, username='bot'))))
+"""
+import errno
+import socket
+from collections import deque
+from select import select
+from time import time, sleep
+
+from client import Client, Response, ClientException, ConnectionClosed, HostMissing, PortMissing, UsernameMissing
+from client import BadServerResponse, HEADER
+
+
+class Future(object):
+    """Result of an asynchronous operation."""
+    PENDING, CANCELLED, FINISHED = 'PENDING', 'CANCELLED', 'FINISHED'
+
+    def __init__(self, deadline=None):
+        """Creates pending future.
+
+        :param deadline: float - time in seconds since the epoch the future expires at, None means no deadline
+        """
+        self.deadline = deadline
+        self.state = self.PENDING
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        """Returns True if the future is finished or cancelled."""
+        return self.state != self.PENDING
+
+    def cancelled(self):
+        """Returns True if the future is cancelled."""
+        return self.state == self.CANCELLED
+
+    def cancel(self):
+        """Cancels the future. Response of a cancelled request is received and discarded.
+
+        :return: bool - True if the future has been cancelled
+        """
+        if self.done():
+            return False
+        self.state = self.CANCELLED
+        self._run_callbacks()
+        return True
+
+    def result(self):
+        """Returns the result or raises the exception of the finished future.
+
+        :return: result value
+        """
+        if self.state == self.CANCELLED:
+            raise RequestCancelled('request is cancelled')
+        if self.state == self.PENDING:
+            raise RequestPending('request is not finished yet')
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self):
+        """Returns the exception of the finished future or None."""
+        return self._exception if self.state == self.FINISHED else None
+
+    def set_result(self, value):
+        """Finishes the future with the value. Does nothing if the future is already done.
+
+        :param value: result value
+        :return: None
+        """
+        if not self.done():
+            self._result, self.state = value, self.FINISHED
+            self._run_callbacks()
+
+    def set_exception(self, exc):
+        """Finishes the future with the exception. Does nothing if the future is already done.
+
+        :param exc: Exception instance
+        :return: None
+        """
+        if not self.done():
+            self._exception, self.state = exc, self.FINISHED
+            self._run_callbacks()
+
+    def add_done_callback(self, callback):
+        """Adds a callback called with the future once it is done.
+
+        :param callback: function - callable taking the future
+        :return: None
+        """
+        if self.done():
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def _run_callbacks(self):
+        """Calls and clears done callbacks."""
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class Return(Exception):
+    """Raised by a coroutine to return a value since Python 2 generators can't return values."""
+
+    def __init__(self, value=None):
+        """Creates return exception.
+
+        :param value: value to be returned by coroutine
+        """
+        super(Return, self).__init__()
+        self.value = value
+
+
+class Task(Future):
+    """Future driving a generator based coroutine which yields futures."""
+
+    def __init__(self, coroutine):
+        """Creates task and runs the coroutine up to the first yielded future.
+
+        :param coroutine: generator - coroutine yielding Future instances
+        """
+        super(Task, self).__init__()
+        self.coroutine = coroutine
+        self.waiting = None
+        self._step()
+
+    def cancel(self):
+        """Cancels the task and the future it waits for."""
+        if not super(Task, self).cancel():
+            return False
+        if self.waiting is not None:
+            self.waiting.cancel()
+        self.coroutine.close()
+        return True
+
+    def _step(self, future=None):
+        """Sends the result of the finished future into the coroutine.
+
+        :param future: Future instance - finished future the coroutine waited for, None for the first step
+        :return: None
+        """
+        if self.done():
+            return
+        try:
+            if future is None:
+                yielded = next(self.coroutine)
+            elif future.cancelled() or future.exception() is not None:
+                try:
+                    future.result()
+                except Exception as exc:
+                    yielded = self.coroutine.throw(exc)
+            else:
+                yielded = self.coroutine.send(future.result())
+        except (Return, StopIteration) as exc:
+            self.set_result(getattr(exc, 'value', None))
+            return
+        except Exception as exc:
+            self.set_exception(exc)
+            return
+        self.waiting = yielded
+        yielded.add_done_callback(self._step)
+
+
+class EventLoop(object):
+    """Select based loop serving any number of AsyncClient connections in one thread."""
+
+    def __init__(self):
+        """Creates an empty loop."""
+        self.clients = set()
+
+    def register(self, client):
+        """Starts serving client connection.
+
+        :param client: AsyncClient instance
+        :return: None
+        """
+        self.clients.add(client)
+
+    def unregister(self, client):
+        """Stops serving client connection.
+
+        :param client: AsyncClient instance
+        :return: None
+        """
+        self.clients.discard(client)
+
+    @staticmethod
+    def spawn(coroutine):
+        """Starts a coroutine.
+
+        :param coroutine: generator - coroutine yielding Future instances
+        :return: Task instance
+        """
+        return Task(coroutine)
+
+    def run_once(self, timeout=None):
+        """Waits for socket events not longer than timeout or the nearest deadline and processes them.
+
+        :param timeout: float - maximal waiting time in seconds, None means wait until an event or a deadline
+        :return: bool - False if there is nothing to wait for: no socket events are expected, no deadlines are set and
+        timeout is None
+        """
+        clients = [client for client in self.clients if client.connection is not None]
+        deadlines = [client.next_deadline() for client in clients]
+        deadlines = [deadline for deadline in deadlines if deadline is not None]
+        if deadlines:
+            wait = max(min(deadlines) - time(), 0)
+            timeout = wait if timeout is None else min(timeout, wait)
+        readable = [client for client in clients if client.pending]
+        writable = [client for client in clients if client.outgoing]
+        if readable or writable:
+            readable, writable, _ = select(readable, writable, [], timeout)
+            for client in writable:
+                client.handle_write()
+            for client in readable:
+                client.handle_read()
+        elif timeout is None:
+            return False
+        elif timeout:
+            sleep(timeout)
+        now = time()
+        for client in clients:
+            client.expire(now)
+        return True
+
+    def run_until_complete(self, future, timeout=None):
+        """Runs the loop until the future is done and returns its result.
+
+        :param future: Future instance - future to wait for
+        :param timeout: float - maximal time in seconds to run the loop, None means no limit
+        :return: result of the future
+        """
+        deadline = time() + timeout if timeout is not None else None
+        while not future.done():
+            if deadline is not None and time() >= deadline:
+                future.set_exception(RequestTimeout('request is timed out'))
+                break
+            if not self.run_once(deadline - time() if deadline is not None else None) and not future.done():
+                future.set_exception(RequestPending('nothing to wait for, the future can never be done'))
+                break
+        return future.result()
+
+
+class AsyncClient(object):
+    """Non-blocking game server client with the same set of requests as Client."""
+
+    def __init__(self, host=None, port=None, timeout=None, username=None, password=None, loop=None):
+        """Initiates client.
+
+        :param host: str - server hostname or IP address
+        :param port: int - port
+        :param timeout: int - default time in seconds given to each request, None means no deadline
+        :param username: string - username
+        :param password: string - password
+        :param loop: EventLoop instance - loop serving the connection, a new loop is created if None
+        """
+        self.host, self.port, self.timeout, self.username, self.password = host, port, timeout, username, password
+        self.loop = loop if loop is not None else EventLoop()
+        self.connection = None
+        self.outgoing = ''
+        self.incoming = bytearray()
+        self.pending = deque()
+        self.closing = False
+        self.last_activity = None
+
+    def fileno(self):
+        """Returns socket file descriptor so the client can be passed to select."""
+        return self.connection.fileno()
+
+    def connect(self):
+        """Creates non-blocking connection with game server. If host or port are None raises corresponding exceptions.
+
+        :return: None
+        """
+        if self.host is None:
+            raise HostMissing('host is missing')
+        if self.port is None:
+            raise PortMissing('port is missing')
+        family, socktype, proto, _, address = socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM)[0]
+        self.connection = socket.socket(family, socktype, proto)
+        self.connection.setblocking(0)
+        code = self.connection.connect_ex(address)
+        if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.connection.close()
+            self.connection = None
+            raise socket.error(code, errno.errorcode.get(code, 'connection failed'))
+        self.outgoing, self.incoming, self.pending, self.closing = '', bytearray(), deque(), False
+        self.last_activity = time()
+        self.loop.register(self)
+
+    def close_connection(self, exc=None):
+        """Closes connection if it is opened and fails pending requests.
+
+        :param exc: Exception instance - exception pending requests are failed with
+        :return: None
+        """
+        if self.connection:
+            self.loop.unregister(self)
+            self.connection.close()
+            self.connection = None
+        pending, self.pending = self.pending, deque()
+        for future in pending:
+            future.set_exception(exc if exc is not None else ConnectionClosed('connection is closed'))
+
+    def request(self, action, body=None, deadline=None, response=True):
+        """Enqueues request.
+
+        :param action: int - action ID
+        :param body: dict - request body
+        :param deadline: float - time in seconds since the epoch the request expires at, default is now + timeout
+        :param response: bool - False if the server doesn't answer the request
+        :return: Future instance resolved with Response instance
+        """
+        if self.connection is None:
+            self.connect()
+        if deadline is None and self.timeout is not None:
+            deadline = time() + self.timeout
+        future = Future(deadline)
+        self.outgoing += Client.encode(action, body)
+        if response:
+            self.pending.append(future)
+        else:
+            future.set_result(None)
+        return future
+
+    def next_deadline(self):
+        """Returns the nearest deadline of pending requests or None."""
+        deadlines = [future.deadline for future in self.pending if future.deadline is not None and not future.done()]
+        return min(deadlines) if deadlines else None
+
+    def expire(self, now):
+        """Fails pending requests which deadlines have passed. Their responses are discarded once received.
+
+        :param now: float - current time in seconds since the epoch
+        :return: None
+        """
+        for future in self.pending:
+            if future.deadline is not None and future.deadline <= now:
+                future.set_exception(RequestTimeout('request is timed out'))
+
+    def handle_write(self):
+        """Sends as much of outgoing data as the socket accepts."""
+        try:
+            sent = self.connection.send(self.outgoing)
+        except socket.error as exc:
+            if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self.close_connection(exc)
+            return
+        self.outgoing = self.outgoing[sent:]
+        if self.closing and not self.outgoing:
+            self.close_connection()
+
+    def handle_read(self):
+        """Receives available data and resolves pending requests with complete responses.
+
+        Data is appended to the bytearray buffer and complete responses are cut off by offset, so a large response
+        received in many chunks is copied once. Raises UnexpectedResponse if a response arrives while no request is
+        pending.
+        """
+        try:
+            chunk = self.connection.recv(65536)
+        except socket.error as exc:
+            if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self.close_connection(exc)
+            return
+        if not chunk:
+            self.close_connection()
+            return
+        self.incoming += chunk
+        self.last_activity = time()
+        offset = 0
+        while len(self.incoming) - offset >= HEADER.size:
+            status, length = HEADER.unpack_from(self.incoming, offset)
+            end = offset + HEADER.size + length
+            if len(self.incoming) < end:
+                break
+            data = str(self.incoming[offset + HEADER.size:end])
+            offset = end
+            if not self.pending:
+                self.close_connection()
+                raise UnexpectedResponse('response {} is received while no request is pending'.format(status))
+            future, response = self.pending.popleft(), Response(status, length, data)
+            if status != 0:
+                message = response.json['error'] if response.data != '' else ''
+                future.set_exception(BadServerResponse('{} {}'.format(response.status, message)))
+            else:
+                future.set_result(response)
+        del self.incoming[:offset]
+
+    def login(self, name=None, password=None, game=None, num_players=None, num_turns=None, deadline=None):
+        """Sends LOGIN request. If name is missing throws UsernameMissing exception.
+
+        :param name: str - player's name
+        :param password: str - player’s password
+        :param game: str - game’s name
+        :param num_players: int - number of players in the game
+        :param num_turns: int - number of turns of the game (game duration)
+        :param deadline: float - time in seconds since the epoch the request expires at
+        :return: Future instance
+        """
+        name = name if name is not None else self.username
+        password = password if password is not None else self.password
+        if name is None:
+            raise UsernameMissing('username is missing')
+        body = {'name': name}
+        if password is not None:
+            body['password'] = password
+        if game is not None:
+            body['game'] = game
+        if num_players is not None:
+            body['num_players'] = num_players
+        if num_turns is not None:
+            body['num_turns'] = num_turns
+        return self.request(1, body, deadline)
+
+    def logout(self):
+        """Sends LOGOUT request and closes connection once the request is sent.
+
+        :return: Future instance
+        """
+        future = self.request(2, response=False)
+        self.closing = True
+        return future
+
+    def move_train(self, line_idx, speed, train_idx, deadline=None):
+        """Sends MOVE request.
+
+        :param line_idx: int - index of the line where the train should be placed on next turn
+        :param speed: int - speed of the train
+        :param train_idx: int - index of the train
+        :param deadline: float - time in seconds since the epoch the request expires at
+        :return: Future instance
+        """
+        return self.request(3, {'line_idx': line_idx, 'speed': speed, 'train_idx': train_idx}, deadline)
+
+    def upgrade(self, posts=None, trains=None, deadline=None):
+        """Sends UPGRADE request.
+
+        :param posts: list - list with indexes of posts to upgrade
+        :param trains: list - list with indexes of trains to upgrade
+        :param deadline: float - time in seconds since the epoch the request expires at
+        :return: Future instance
+        """
+        posts = posts if posts is not None else []
+        trains = trains if trains is not None else []
+        return self.request(4, {'posts': posts, 'trains': trains}, deadline)
+
+    def turn(self, deadline=None):
+        """Sends TURN request.
+
+        :param deadline: float - time in seconds since the epoch the request expires at
+        :return: Future instance
+        """
+        return self.request(5, deadline=deadline)
+
+    def player(self, deadline=None):
+        """Sends PLAYER request.
+
+        :param deadline: float - time in seconds since the epoch the request expires at
+        :return: Future instance
+        """
+        return self.request(6, deadline=deadline)
+
+    def games(self, deadline=None):
+        """Sends GAMES request.
+
+        :param deadline: float - time in seconds since the epoch the request expires at
+        :return: Future instance
+        """
+        return self.request(7, deadline=deadline)
+
+    def get_static_objects(self, deadline=None):
+        """Sends MAP request for static objects.
+
+        :param deadline: float - time in seconds since the epoch the request expires at
+        :return: Future instance
+        """
+        return self.request(10, {'layer': 0}, deadline)
+
+    def get_dynamic_objects(self, deadline=None):
+        """Sends MAP request for dynamic objects.
+
+        :param deadline: float - time in seconds since the epoch the request expires at
+        :return: Future instance
+        """
+        return self.request(10, {'layer': 1}, deadline)
+
+    def get_point_coordinates(self, deadline=None):
+        """Sends MAP request for point coordinates.
+
+        :param deadline: float - time in seconds since the epoch the request expires at
+        :return: Future instance
+        """
+        return self.request(10, {'layer': 10}, deadline)
+
+
+class RequestTimeout(ClientException):
+    """Request deadline exceeded exception class."""
+    pass
+
+
+class RequestCancelled(ClientException):
+    """Cancelled request exception class."""
+    pass
+
+
+class RequestPending(ClientException):
+    """Not finished request exception class."""
+    pass
+
+
+class UnexpectedResponse(BadServerResponse):
+    """Response received without a pending request exception class."""
+    pass
@@ -2,12 +2,19 @@
 # -*- coding: utf-8 -*-
 """The module implements bot for playing the game."""
 from Queue import Queue
+from argparse import ArgumentParser
+from collections import deque
 from functools import wraps
-from json import loads
 from socket import error, herror, gaierror, timeout
-from time import sleep
+from time import time
 
-from client import Client, ClientException
+from numpy import argsort, array, concatenate, cumsum, inf, minimum, searchsorted, where
+
+from client import Client, ClientException, BatchError
+from lobby import Lobby
+from routing import AllPairsPaths, CompactGraph, ContractionHierarchy, Landmarks, ShortestPaths
+from tracing import TickProfiler
+from world import Occupancy, World
 
 
 def client_exceptions(func):
@@ -27,34 +34,134 @@ def client_exceptions(func):
     return wrapped
 
 
+def profiled(phase):
+    """Times calls of the bot method as the phase of the tick if the bot has a profiler.
+
+    :param phase: string - phase name
+    :return: decorator
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapped(self, *args, **kwargs):
+            if self.profiler is None:
+                return func(self, *args, **kwargs)
+            started = time()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self.profiler.measure(phase, time() - started)
+
+        return wrapped
+
+    return decorator
+
+
+class EventSink(object):
+    """Bounded replacement of the application queue for bots running without GUI.
+
+    Keeps only the last maxlen events, so memory stays flat however long nobody drains it, and passes status strings
+    to the callback.
+    """
+
+    def __init__(self, maxlen=0, status=None):
+        """Creates sink.
+
+        :param maxlen: int - number of kept events, default is 0 dropping all of them
+        :param status: function - called with every status string, default is None
+        """
+        self.events = deque(maxlen=maxlen)
+        self.status = status
+
+    def put(self, item, block=True, timeout=None):
+        """Keeps the event dropping the oldest one if the sink is full.
+
+        :param item: tuple - request type and request body as the application expects them
+        :return: None
+        """
+        if item[0] == 0 and self.status is not None:
+            self.status(item[1])
+        self.events.append(item)
+
+    def get_nowait(self):
+        """Returns the oldest kept event."""
+        return self.events.popleft()
+
+    def empty(self):
+        """Returns True if no events are kept."""
+        return not self.events
+
+
 class Bot(object):
     """The bot main class."""
+    ROUTING = {'all_pairs': AllPairsPaths, 'hierarchy': ContractionHierarchy}
+    ALL_PAIRS_LIMIT = 2000
+    BUDGET_HISTORY = 1000
+    RESERVED_TICKS = 4
+
+    def __init__(self, tracer=None, recorder=None, transport=None, routing=None, geometry=False, budget=None,
+                 speculate=True, queue=None, profiler=None):
+        """Initiates bot.
 
-    def __init__(self):
-        """Initiates bot."""
+        :param tracer: tracing.Tracer instance - collects client requests statistics, None disables tracing
+        :param recorder: replay.Recorder instance - records client session, None disables recording
+        :param transport: function - creates client connection, e.g. replay.Replay instance, default is a socket
+        :param routing: string - preprocessing of static graph views: 'all_pairs' distance matrices or 'hierarchy' of
+        contracted points for maps too large for matrices, default is None choosing by number of points
+        :param geometry: bool - requests point coordinates and uses them as lower bounds of distances in landmark
+        searches when True
+        :param budget: float - seconds of planning per tick, trains not planned in time continue their routes, default
+        is None for no limit
+        :param speculate: bool - plans routes of trains arriving at junctions on the predicted state of the next tick
+        while the turn request is in flight when True
+        :param queue: Queue.Queue or EventSink instance - receives status and map events, default is None for an
+        unbounded Queue drained by the application
+        :param profiler: tracing.TickProfiler instance - times phases of ticks and counts path searches and graph view
+        rebuilds, None disables profiling
+        """
         self.host = None
         self.port = None
         self.timeout = None
+        self.tracer = tracer
+        self.profiler = profiler
+        self.recorder = recorder
+        self.transport = transport
+        self.routing = routing
+        self.geometry = geometry
+        self.budget = budget
+        self.deadline = None
+        self.budget_usage = deque(maxlen=self.BUDGET_HISTORY)
+        self.speculate = speculate
+        self.moves = {}
+        self.speculative = {}
         self.client = None
+        self.lobby = None
+        self.pipeline = None
         self.game = None
-        self.queue = Queue()
+        self.queue = queue if queue is not None else Queue()
         self.started = False
         self.current_tick = 0
         self.lines = {}
         self.points = {}
-        self.adjacent = {}
-        self.adjacent_no_markets = {}
-        self.adjacent_no_storages = {}
+        self.graph = None
+        self.adjacent = None
+        self.adjacent_no_markets = None
+        self.adjacent_no_storages = None
+        self.precomputed = []
+        self.landmarks = None
+        self.town_paths = None
         self.markets = []
         self.storages = []
         self.player_idx = None
         self.town = None
         self.idx = None
         self.ratings = {}
-        self.posts = {}
-        self.trains = {}
+        self.world = World()
+        self.posts = self.world.posts
+        self.trains = self.world.trains
+        self.post_arrays = {}
+        self.goods_posts = {}
         self.expected_goods = {}
-        self.occupied = {}
+        self.occupancy = Occupancy(self.lines)
 
     def refresh_status_bar(self, value):
         """Enqueues application status bar refresh request.
@@ -75,80 +182,146 @@ class Bot(object):
         """
         self.refresh_status_bar('Connecting...')
         self.current_tick = 0
+        self.budget_usage.clear()
         self.expected_goods = {}
-        response = loads(self.client.login(game=game, num_players=num_players, num_turns=num_turns).data)
+        self.world.clear()
+        self.town = None
+        self.post_arrays = {}
+        self.occupancy.clear()
+        self.markets, self.storages = [], []
+        self.town_paths = None
+        response = self.client.login(game=game, num_players=num_players, num_turns=num_turns).json
         self.player_idx = response['idx']
         self.queue.put((1, self.player_idx))
         self.refresh_status_bar('{}: {}'.format(response['name'], response['rating']))
 
     @client_exceptions
     def build_map(self):
-        """Requests static objects and enqueues draw map request."""
-        static_objects = self.client.get_static_objects().data
+        """Requests static objects and enqueues draw map request with them decoded."""
+        static_objects = self.client.get_static_objects().json
         self.queue.put((2, static_objects))
-        static_objects = loads(static_objects)
         for point in static_objects['points']:
             self.points[point['idx']] = point
         for line in static_objects['lines']:
             self.lines[line['idx']] = line
-        self.adjacent = self.get_adjacent()
+        self.graph = CompactGraph(self.lines)
+        self.adjacent = self.graph.full
+        self.adjacent_no_markets, self.adjacent_no_storages = None, None
+        self.precomputed = [(self.adjacent, self.preprocess(self.adjacent))]
+        coordinates = None
+        if self.geometry:
+            layer = self.client.get_point_coordinates().json
+            coordinates = dict((point['idx'], (point['x'], point['y'])) for point in layer['coordinates'])
+        counter = self.profiler.count if self.profiler is not None else None
+        self.landmarks = Landmarks(self.adjacent, coordinates=coordinates, counter=counter)
+        self.town_paths = None
 
     @client_exceptions
+    @profiled('refresh_map')
     def refresh_map(self):
-        """Requests dynamic objects and enqueues refresh map request."""
-        dynamic_objects = loads(self.client.get_dynamic_objects().data)
-        self.queue.put((3, dynamic_objects))
-        self.idx = dynamic_objects['idx']
-        self.ratings = dynamic_objects['ratings']
-        for post in dynamic_objects['posts']:
-            self.posts[post['point_idx']] = post
-            if post['type'] == 1 and post['player_idx'] == self.player_idx:
-                self.town = post
-                for event in post['events']:
-                    if event['type'] == 100:
-                        self.stop()
-                        self.refresh_status_bar('Game over!')
-                        self.queue.put((99, None))
-                        return
-        self.occupied = {}
-        for train in dynamic_objects['trains']:
-            self.trains[train['idx']] = train
-            self.occupied[train['idx']] = {'line_idx': train['line_idx'], 'position': train['position']}
-            if train['player_idx'] == self.player_idx and train['idx'] not in self.expected_goods:
-                self.expected_goods[train['idx']] = {'type': None, 'amount': None, 'trip': None, 'route': None}
+        """Requests changes of dynamic objects, applies them and enqueues refresh map request with the changes."""
+        delta = self.client.get_dynamic_delta()
+        self.queue.put((3, delta))
+        self.idx = delta['idx']
+        self.ratings = delta['ratings']
+        self.world.apply(delta)
+        self.update_goods_posts()
+        if self.town is None or self.town.point_idx not in self.posts:
+            self.town = self.world.town(self.player_idx)
+        for event in self.town.events:
+            if event['type'] == 100:
+                self.stop()
+                self.refresh_status_bar('Game over!')
+                self.queue.put((99, None))
+                return
+        for idx in self.world.changed_trains:
+            if self.trains[idx].player_idx == self.player_idx and idx not in self.expected_goods:
+                self.expected_goods[idx] = {'type': None, 'amount': None, 'trip': None, 'route': None}
+        for idx in self.world.removed_trains:
+            self.occupancy.remove(idx)
+            self.expected_goods.pop(idx, None)
+        self.occupancy.towns = self.world.posts_by_type.get(1, ())
+        for idx in self.world.changed_trains | set(self.expected_goods):
+            self.occupancy.place(idx, self.trains[idx].line_idx, self.trains[idx].position)
         if not self.markets or not self.storages:
-            self.markets = [idx for idx, attrs in self.posts.items() if attrs['type'] == 2]
-            self.storages = [idx for idx, attrs in self.posts.items() if attrs['type'] == 3]
+            self.markets = list(self.world.posts_by_type.get(2, ()))
+            self.storages = list(self.world.posts_by_type.get(3, ()))
             self.adjacent_no_markets = self.get_adjacent(exclude_points=self.markets)
             self.adjacent_no_storages = self.get_adjacent(exclude_points=self.storages)
+            for adjacent in (self.adjacent_no_markets, self.adjacent_no_storages):
+                if all(precomputed is not adjacent for precomputed, _ in self.precomputed):
+                    self.precomputed.append((adjacent, self.preprocess(adjacent)))
         rating = '{}: {}'.format(self.ratings[self.player_idx]['name'], self.ratings[self.player_idx]['rating'])
         self.refresh_status_bar(rating)
 
-    @client_exceptions
-    def get_available_games(self, host=None, port=None, time_out=None):
-        """Requests available games and enqueues list of available games names.
+    def get_lobby(self, host=None, port=None, time_out=None):
+        """Returns running lobby watcher of the server creating it or recreating it for another server if needed.
 
         :param host: string - host
         :param port: int - port
         :param time_out: int - timeout
+        :return: Lobby instance
+        """
+        if self.lobby is not None and self.lobby.address != (host, port, time_out):
+            listeners = self.lobby.listeners
+            self.lobby.stop()
+            self.lobby = None
+        else:
+            listeners = []
+        if self.lobby is None:
+            self.lobby = Lobby(host=host, port=port, timeout=time_out, transport=self.transport)
+            self.lobby.start()
+            for listener in listeners:
+                self.lobby.add_listener(listener)
+        return self.lobby
+
+    def enqueue_games(self, games):
+        """Enqueues list of available games names.
+
+        :param games: list - games names
         :return: None
         """
-        self.connect(host=host, port=port, time_out=time_out)
-        response = loads(self.client.games().data)
-        games = [game['name'] for game in response['games']]
         self.queue.put((4, games))
 
-    @client_exceptions
-    def game_is_run(self):
-        """Returns True if the game is run and False in all other cases.
+    def get_available_games(self, host=None, port=None, time_out=None):
+        """Subscribes to available games. The lobby watcher enqueues list of games names every time it changes.
 
-        :return: bool
+        :param host: string - host
+        :param port: int - port
+        :param time_out: int - timeout
+        :return: None
         """
-        games = loads(self.client.games().data)['games']
-        for game in games:
-            if game['name'] == self.game and game['state'] == 2:
-                return True
-        return False
+        lobby = self.get_lobby(host=host, port=port, time_out=time_out)
+        if self.enqueue_games not in lobby.listeners:
+            lobby.add_listener(self.enqueue_games)
+
+    def stop_available_games(self):
+        """Unsubscribes from available games."""
+        if self.lobby is not None:
+            self.lobby.remove_listener(self.enqueue_games)
+
+    def wait_for_game(self, interval=1):
+        """Waits for the game to be run. Returns as soon as the lobby watcher receives the game in run state, when the
+        bot is stopped or when the lobby watcher is stopped. Errors of the watcher are shown in the status bar while
+        it keeps polling.
+
+        :param interval: float - longest time in seconds the bot takes to notice it is stopped
+        :return: bool - True if the game is run and False in all other cases
+        """
+        lobby = self.get_lobby(host=self.host, port=self.port, time_out=self.timeout)
+        run = False
+        while not run and self.started and not lobby.stopped:
+            run = lobby.wait_for_state(self.game, 2, interval)
+            if not run and lobby.error is not None:
+                message = lobby.error.message if lobby.error.message != '' else lobby.error.strerror
+                self.refresh_status_bar('Error: {}'.format(message))
+        return run
+
+    def stop_lobby(self):
+        """Stops the lobby watcher if it is running. The next subscription to available games starts a new one."""
+        if self.lobby is not None:
+            self.lobby.stop()
+            self.lobby = None
 
     @client_exceptions
     def logout(self):
@@ -157,9 +330,22 @@ class Bot(object):
 
     @client_exceptions
     def tick(self):
-        """Sends turn request, updates current tick number and refreshes map."""
-        self.client.turn()
+        """Sends turn request with all actions of the turn, updates current tick number and refreshes map.
+
+        Routes of the next tick are planned speculatively while the server is processing the turn.
+        """
+        started = time()
+        requests = self.pipeline.turn().send()
+        if self.speculate:
+            self.plan_speculatively()
+        try:
+            self.pipeline.receive(requests)
+        except BatchError as exc:
+            self.refresh_status_bar('Error: {}'.format(exc.message))
+        if self.profiler is not None:
+            self.profiler.measure('turn', time() - started)
         self.current_tick += 1
+        self.occupancy.release(self.current_tick)
         self.refresh_map()
         for train_idx, goods in self.expected_goods.items():
             if goods['trip'] and self.trains[train_idx]['speed'] != 0:
@@ -176,20 +362,22 @@ class Bot(object):
         :return: None
         """
         if self.client:
+            self.client.close_connection()
             if self.host != host or self.port != port or self.timeout != time_out:
-                if self.client.connection:
-                    self.client.close_connection()
                 self.host, self.port, self.timeout = host, port, time_out
-                self.client = Client(host=self.host, port=self.port, timeout=self.timeout)
-            self.client.connect()
+                self.client.host, self.client.port, self.client.timeout = self.host, self.port, self.timeout
             self.client.username, self.client.password = username, password
+            self.client.connect()
         else:
             self.host, self.port, self.timeout = host, port, time_out
             self.client = Client(host=self.host,
                                  port=self.port,
                                  timeout=self.timeout,
                                  username=username,
-                                 password=password)
+                                 password=password,
+                                 tracer=self.tracer,
+                                 recorder=self.recorder,
+                                 transport=self.transport)
             self.client.connect()
 
     def start(self, host=None, port=None, time_out=None, username=None, password=None, game=None, num_players=None,
@@ -211,89 +399,253 @@ class Bot(object):
         try:
             self.connect(host=host, port=port, time_out=time_out, username=username, password=password)
             self.login(game=self.game, num_players=num_players, num_turns=num_turns)
-            if self.game:
-                while self.started and not self.game_is_run():
-                    sleep(1)
-            self.build_map()
-            self.refresh_map()
-            while self.started:
-                self.upgrade()
-                self.move_trains()
+            if self.game and not self.wait_for_game():
+                self.stop()
+            if self.lobby is not None and not self.lobby.listeners:
+                self.stop_lobby()
+            if self.started:
+                self.build_map()
+                self.refresh_map()
+                self.pipeline = self.client.pipeline()
+            while self.started and self.client.connection is not None:
+                if self.profiler is not None:
+                    self.profiler.start_tick(self.current_tick)
+                self.plan_turn()
                 self.tick()
+                if self.profiler is not None:
+                    self.profiler.end_tick()
             self.logout()
         except Exception as exc:
             self.queue.put((99, exc))
             raise exc
 
+    @profiled('plan_turn')
+    def plan_turn(self):
+        """Enqueues upgrades and moves of the turn within the planning budget and records the budget usage.
+
+        Usage of the last BUDGET_HISTORY ticks is kept, so memory stays flat over long games.
+        """
+        started = time()
+        self.deadline = started + self.budget if self.budget is not None else None
+        self.upgrade()
+        continued = self.move_trains()
+        elapsed = time() - started
+        self.budget_usage.append({'tick': self.current_tick, 'elapsed': elapsed, 'continued': continued,
+                                  'used': elapsed / self.budget if self.budget else None})
+
+    def out_of_budget(self):
+        """Returns True if the planning deadline of the turn has passed."""
+        return self.deadline is not None and time() >= self.deadline
+
     def stop(self):
         """Stops bot."""
         self.started = False
 
+    def close(self):
+        """Stops bot and its lobby watcher."""
+        self.stop()
+        self.stop_lobby()
+
     def get_adjacent(self, exclude_points=None, exclude_lines=None):
-        """Returns new dict of adjacent points. Excludes points and lines from exclude_point and exclude_line lists.
-
-        :param exclude_points: list - points to be excluded from adjacent dict
-        :param exclude_lines: list - lines to be excluded from adjacent dict
-        :return: dict - dict of adjacent points
-        """
-        if not exclude_lines and not exclude_points and self.adjacent:
-            adjacent = self.adjacent
-        elif exclude_points == self.markets and not exclude_lines and self.adjacent_no_markets:
-            adjacent = self.adjacent_no_markets
-        elif exclude_points == self.storages and not exclude_lines and self.adjacent_no_storages:
-            adjacent = self.adjacent_no_storages
-        else:
-            adjacent = {}
-            for idx, attrs in self.lines.items():
-                if exclude_lines and idx in exclude_lines:
-                    continue
-                start_point, end_point = attrs['points'][0], attrs['points'][1]
-                if exclude_points and (start_point in exclude_points or end_point in exclude_points):
-                    continue
-                if start_point not in adjacent.keys():
-                    adjacent[start_point] = {}
-                if end_point not in adjacent.keys():
-                    adjacent[end_point] = {}
-                adjacent[start_point][end_point] = idx
-                adjacent[end_point][start_point] = idx
-        return adjacent
+        """Returns view of the map graph without points and lines from exclude_points and exclude_lines lists.
+
+        The base, no markets and no storages views are reused, others only allocate masks of excluded points and lines.
+        :param exclude_points: list - points to be excluded from the view
+        :param exclude_lines: list - lines to be excluded from the view
+        :return: routing.GraphView instance
+        """
+        if not exclude_lines:
+            excluded_points = frozenset(exclude_points or ())
+            for adjacent in (self.adjacent, self.adjacent_no_markets, self.adjacent_no_storages):
+                if adjacent is not None and adjacent.excluded_points == excluded_points:
+                    return adjacent
+        if self.profiler is not None:
+            self.profiler.count('adjacency')
+        return self.graph.view(exclude_points=exclude_points, exclude_lines=exclude_lines)
 
     def dijkstra_algorithm(self, point, adjacent):
         """Calculates shortest paths from the point to all other points.
 
         :param point: int - point index
-        :param adjacent: dict - dict of adjacent points
+        :param adjacent: routing.GraphView instance - view of the map graph
         :return: 2-tuple of dictionaries where the first one is shortest paths and the second one is distance of paths
         """
-        point_to, dist_to, visited = {}, {}, {}
-        for point_idx in adjacent.keys():
-            dist_to[point_idx] = float('inf') if point_idx != point else 0
-        while dist_to:
-            closest_point = min(dist_to, key=dist_to.get)
-            for point_idx, line_idx in adjacent[closest_point].items():
-                if point_idx not in visited:
-                    new_dist = dist_to[closest_point] + self.lines[line_idx]['length']
-                    if new_dist < dist_to[point_idx]:
-                        dist_to[point_idx] = new_dist
-                        point_to[point_idx] = closest_point
-            visited[closest_point] = dist_to[closest_point]
-            dist_to.pop(closest_point)
-        return point_to, visited
+        if self.profiler is not None:
+            self.profiler.count('dijkstra')
+        paths = ShortestPaths(point, adjacent)
+        return paths.point_to, paths.points_dist
+
+    def preprocess(self, adjacent):
+        """Precomputes routing structure for the static view of the map graph.
+
+        :param adjacent: routing.GraphView instance - view of the map graph
+        :return: routing.AllPairsPaths or routing.ContractionHierarchy instance
+        """
+        routing = self.routing
+        if routing is None:
+            routing = 'all_pairs' if len(adjacent) <= self.ALL_PAIRS_LIMIT else 'hierarchy'
+        return self.ROUTING[routing](adjacent)
+
+    def get_paths(self, point, adjacent):
+        """Returns shortest paths tree from the point. Takes it from routing structures precomputed for the base,
+        no markets and no storages views and runs landmark searches on demand when other points or lines are
+        excluded. Landmark searches answer single path queries, distances to many posts come from a Dijkstra tree.
+        The profiler counts both as 'landmarks' and 'dijkstra'.
+
+        :param point: int - point index
+        :param adjacent: routing.GraphView instance - view of the map graph
+        :return: routing.PathsRow, routing.HierarchyPaths, routing.LandmarkPaths or routing.ShortestPaths instance
+        """
+        for precomputed, paths in self.precomputed:
+            if precomputed is adjacent:
+                return paths.tree(point)
+        if self.landmarks is not None:
+            return self.landmarks.tree(point, adjacent)
+        if self.profiler is not None:
+            self.profiler.count('dijkstra')
+        return ShortestPaths(point, adjacent)
+
+    def get_town_paths(self):
+        """Returns shortest paths tree from the town over the whole map. The tree is built once per map.
 
+        :return: routing.PathsRow or routing.ShortestPaths instance
+        """
+        if self.town_paths is None or self.town_paths.source != self.town['point_idx']:
+            self.town_paths = self.get_paths(self.town['point_idx'], self.adjacent)
+        return self.town_paths
+
+    @profiled('move_trains')
     def move_trains(self):
-        """Moves trains over their rotes and checks if a collision can occur in next move position."""
-        player_trains = [train for train in self.trains.values()
-                         if train['player_idx'] == self.player_idx and train['cooldown'] == 0]
+        """Enqueues moves of trains over their rotes and checks if a collision can occur in next move position.
+
+        Trains without routes to continue are planned first. Once the planning deadline has passed, trains needing new
+        routes continue their last routes instead.
+        :return: int - number of trains continuing their last routes
+        """
+        player_trains = [train for train in self.world.player_trains(self.player_idx) if train.cooldown == 0]
+        player_trains.sort(key=lambda train: (self.expected_goods[train.idx]['route'] is not None, train.idx))
+        continued = 0
+        self.moves = {}
+        for train in self.world.player_trains(self.player_idx):
+            if train.cooldown:
+                self.occupancy.cancel(train.idx)
         for train in player_trains:
             idx, line_idx, position, speed = train['idx'], train['line_idx'], train['position'], train['speed']
             if position == 0 or position == self.lines[line_idx]['length'] or speed == 0:
-                line_idx, position, speed = self.get_direction(idx)
+                if self.out_of_budget():
+                    line_idx, position, speed = self.follow_route(idx)
+                    continued += 1
+                else:
+                    line_idx, position, speed = self.plan_direction(idx)
             else:
                 position += speed
             line_idx, position, speed = self.check_collision(idx, line_idx, position, speed)
-            self.client.move_train(line_idx, speed, idx)
-            self.occupied[idx]['line_idx'] = line_idx
-            self.occupied[idx]['position'] = position
+            self.pipeline.move_train(line_idx, speed, idx)
+            self.occupancy.place(idx, line_idx, position)
+            self.reserve_line(idx, line_idx, position, speed)
+            self.moves[idx] = line_idx, position, speed
+        self.speculative = {}
+        return continued
+
+    def plan_inputs(self, train_idx):
+        """Returns the state goods_manager plans a route of the train at a point from.
+
+        Equal inputs give equal routes, so a route planned speculatively is valid if its inputs match the actual ones.
+        :param train_idx: int - train index
+        :return: tuple
+        """
+        train = self.trains[train_idx]
+        expected = tuple((idx, goods['type'], goods['trip'], goods['amount'], tuple(goods['route'] or ()))
+                         for idx, goods in sorted(self.expected_goods.items()))
+        posts = tuple(tuple(values.tolist()) for goods_type in (2, 3) for values in self.get_goods_posts(goods_type))
+        product_level = float(self.town['product']) / float(self.town['product_capacity'])
+        return (train.line_idx, train.position, train.goods, train.goods_capacity, expected, posts,
+                self.town['population'], product_level > 0.6)
+
+    @profiled('speculate')
+    def plan_speculatively(self):
+        """Plans routes of trains which will need new routes on the next tick on the state predicted by their moves.
+
+        Trains are predicted to load goods at markets and storages and unload them in the town, markets and storages
+        to be replenished, the town fed and trips of moving trains shortened. Plans are kept with their inputs and
+        plan_direction takes them only if the inputs match the actual state. The predicted state is reverted afterwards.
+        :return: None
+        """
+        self.speculative = {}
+        planned = []
+        for idx, (line_idx, position, speed) in self.moves.items():
+            if speed == 0 or position in (0, self.lines[line_idx]['length']):
+                planned.append(idx)
+        if not planned:
+            return
+        expected_goods, goods_posts, product = self.expected_goods, self.goods_posts, self.town.product
+        states = dict((idx, (self.trains[idx].line_idx, self.trains[idx].position, self.trains[idx].speed,
+                             self.trains[idx].goods, self.trains[idx].goods_type)) for idx in planned)
+        try:
+            self.predict(planned)
+            planned.sort(key=lambda idx: (self.expected_goods[idx]['route'] is not None, idx))
+            for idx in planned:
+                inputs = self.plan_inputs(idx)
+                self.goods_manager(idx)
+                self.speculative[idx] = inputs, self.expected_goods[idx]
+        finally:
+            self.expected_goods, self.goods_posts, self.town.product = expected_goods, goods_posts, product
+            for idx, state in states.items():
+                train = self.trains[idx]
+                train.line_idx, train.position, train.speed, train.goods, train.goods_type = state
+
+    def predict(self, planned):
+        """Replaces the state with the one predicted for the next tick. Records are changed without marking changes.
+
+        :param planned: list - indexes of trains to be planned
+        :return: None
+        """
+        self.expected_goods = dict((idx, dict(goods)) for idx, goods in self.expected_goods.items())
+        for idx, goods in self.expected_goods.items():
+            line_idx, position, speed = self.moves.get(idx, (None, None, self.trains[idx].speed))
+            if idx in self.moves and position in (0, self.lines[line_idx]['length']):
+                speed = 0
+            if goods['trip'] and speed != 0:
+                goods['trip'] -= 1
+        taken, delivered = {}, 0
+        for idx in sorted(planned):
+            train = self.trains[idx]
+            train.line_idx, train.position, train.speed = self.moves[idx]
+            train.speed = 0
+            line = self.lines[train.line_idx]
+            point = line['points'][0] if train.position == 0 else line['points'][1]
+            post = self.posts.get(point) if train.position in (0, line['length']) else None
+            if post is None:
+                continue
+            if post is self.town:
+                delivered += train.goods if train.goods_type == 2 else 0
+                train.goods, train.goods_type = 0, None
+            elif post.type in (2, 3) and train.goods_type in (None, post.type):
+                stock = post.product if post.type == 2 else post.armor
+                amount = min(train.goods_capacity - train.goods, stock - taken.get(point, 0))
+                if amount > 0:
+                    taken[point] = taken.get(point, 0) + amount
+                    train.goods, train.goods_type = train.goods + amount, post.type
+        goods_posts = {}
+        for goods_type in (2, 3):
+            points, stock, capacity, replenishment = self.get_goods_posts(goods_type)
+            stock = stock - array([taken.get(point, 0) for point in points.tolist()], dtype=int)
+            goods_posts[goods_type] = points, minimum(stock + replenishment, capacity), capacity, replenishment
+        self.goods_posts = goods_posts
+        product = min(self.town.product + delivered, self.town.product_capacity)
+        self.town.product = max(product - self.town.population, 0)
+
+    def plan_direction(self, train_idx):
+        """Returns new train moving attributes taking the speculative route if it was planned from the actual state.
+
+        :param train_idx: int - train index
+        :return: tuple - 3-tuple: line_idx, position, speed
+        """
+        speculative = self.speculative.pop(train_idx, None)
+        if speculative is not None and speculative[0] == self.plan_inputs(train_idx):
+            self.expected_goods[train_idx] = speculative[1]
+            return self.follow_route(train_idx)
+        return self.get_direction(train_idx)
 
     def get_current_point(self, train_idx):
         """Returns the current point of the train.
@@ -307,7 +659,7 @@ class Bot(object):
         if 0 < position < line_length:
             route = self.expected_goods[train_idx]['route']
             start_point, end_point = self.lines[line_idx]['points'][0], self.lines[line_idx]['points'][1]
-            current = route[min(route.index(start_point), route.index(end_point))]
+            current = route[min(route.index(start_point), route.index(end_point))] if route else start_point
         else:
             current = self.lines[line_idx]['points'][0] if position == 0 else self.lines[line_idx]['points'][1]
         return current
@@ -317,20 +669,14 @@ class Bot(object):
 
         :param point_from: int - point index to build way from
         :param target_point: int - target point index
-        :param adjacent: dict - dict of adjacent points
+        :param adjacent: routing.GraphView instance - view of the map graph
         :return: return: 2-tuple where the first item is a trip length to the target point and the second item
-        is a list of turn points
-        """
-        point_to, trip_to = self.dijkstra_algorithm(point_from, adjacent)
-        turn_points = [target_point]
-        if target_point != point_from:
-            temp_point = target_point
-            while point_to[temp_point] != point_from:
-                temp_point = point_to[temp_point]
-                turn_points.append(temp_point)
-            turn_points.append(point_from)
-        return trip_to[target_point], list(reversed(turn_points))
+        is a list of turn points, float('inf') and None if the target point is unreachable
+        """
+        paths = self.get_paths(point_from, adjacent)
+        return paths.distance(target_point), paths.path(target_point)
 
+    @profiled('get_route')
     def get_route(self, train_idx, goods_type, exclude_points=None, exclude_lines=None):
         """Returns 3-tuple of most profitable route characteristics or back-to-town route characteristics.
 
@@ -347,13 +693,10 @@ class Bot(object):
         train = self.trains[train_idx]
         current = self.get_current_point(train_idx)
         if train['goods'] < train['goods_capacity']:
-            targets = []
-            for idx, post in self.posts.items():
-                if post['type'] == goods_type and idx != current:
-                    targets.append(post)
-            if current in self.posts and self.posts[current]['type'] == goods_type:
-                targets.append(self.town)
-            max_efficiency, trip, goods, route = -1 * float('inf'), 0, 0, [current]
+            points, stock, capacity, replenishment = self.get_goods_posts(goods_type)
+            others = points != current
+            at_post = current in self.posts and self.posts[current]['type'] == goods_type
+            trip, goods, route = 0, 0, [current]
             if train['goods'] == 0:
                 if goods_type == 2:
                     adjacent = self.get_adjacent(exclude_points=self.storages + exclude_points,
@@ -363,35 +706,39 @@ class Bot(object):
                                                  exclude_lines=exclude_lines)
             else:
                 adjacent = self.get_adjacent(exclude_points=exclude_points, exclude_lines=exclude_lines)
-            for post in targets:
-                if current in adjacent.keys():
-                    trip_to, points_to = self.get_turn_points(current, post['point_idx'], adjacent)
-                else:
-                    return None, None, None
-                trip_from, points_from = self.get_turn_points(post['point_idx'], self.town['point_idx'], self.adjacent)
-                if post != self.town:
-                    post_goods = post['product'] if goods_type == 2 else post['armor']
-                    post_capacity = post['product_capacity'] if goods_type == 2 else post['armor_capacity']
-                    mined = sum([goods['amount'] for goods in self.expected_goods.values()
-                                 if goods['trip'] and goods['trip'] < trip_to])
-                    replenishment = post_goods + post['replenishment'] * trip_to - mined
-                    available_goods = post_capacity if replenishment >= post_capacity else replenishment
-                    space = train['goods_capacity'] - train['goods']
-                    goods = train['goods_capacity'] if available_goods >= space else train['goods'] + available_goods
-                    if goods_type == 2:
-                        efficiency = goods - (trip_to + trip_from) * self.town['population']
-                    else:
-                        efficiency = goods / (trip_to + trip_from)
-                else:
-                    goods = train['goods']
-                    efficiency = goods - (trip_to + trip_from) * self.town['population']
-                if efficiency > max_efficiency:
-                    max_efficiency = efficiency
-                    trip = trip_to + trip_from
-                    route = points_to
+            if (others.any() or at_post) and current not in adjacent:
+                return None, None, None
+            paths_to, paths_from = self.get_paths(current, adjacent), self.get_town_paths()
+            points, stock, capacity, replenishment = points[others], stock[others], capacity[others], \
+                replenishment[others]
+            trip_to = paths_to.distances(points)
+            reachable = trip_to != inf
+            points, stock, capacity, replenishment = points[reachable], stock[reachable], capacity[reachable], \
+                replenishment[reachable]
+            trip_to = trip_to[reachable].astype(int)
+            trips = trip_to + paths_from.distances(points).astype(int)
+            available = stock + replenishment * trip_to - self.get_mined(trip_to)
+            available = where(available >= capacity, capacity, available)
+            space = train['goods_capacity'] - train['goods']
+            amounts = where(available >= space, train['goods_capacity'], train['goods'] + available)
+            if goods_type == 2:
+                efficiency = amounts - trips * self.town['population']
+            else:
+                efficiency = amounts // trips
+            if at_post and self.town['point_idx'] in paths_to:
+                town_trip = paths_to.distance(self.town['point_idx'])
+                points = concatenate((points, [self.town['point_idx']]))
+                trips = concatenate((trips, [town_trip]))
+                amounts = concatenate((amounts, [train['goods']]))
+                efficiency = concatenate((efficiency, [train['goods'] - town_trip * self.town['population']]))
+            if len(points):
+                best = efficiency.argmax()
+                trip, goods, route = int(trips[best]), int(amounts[best]), paths_to.path(int(points[best]))
         else:
             adjacent = self.get_adjacent(exclude_points=exclude_points, exclude_lines=exclude_lines)
             trip, route = self.get_turn_points(current, self.town['point_idx'], adjacent)
+            if route is None:
+                return None, None, None
             goods = self.trains[train_idx]['goods']
         current_line_idx = self.trains[train_idx]['line_idx']
         start_point, end_point = self.lines[current_line_idx]['points'][0], self.lines[current_line_idx]['points'][1]
@@ -399,6 +746,65 @@ class Bot(object):
         route = [end_point] + route if end_point not in route else route
         return trip, goods, route
 
+    def update_goods_posts(self):
+        """Updates arrays of markets and storages by posts changed in the last map refresh.
+
+        Arrays are rebuilt in the order of self.posts only when posts are added or removed, otherwise values of changed
+        posts are written to copies of the arrays, so arrays taken by planners earlier are not modified.
+        :return: None
+        """
+        changed = [self.posts[point] for point in self.world.changed_posts]
+        rebuild = bool(self.world.removed_posts) or any('idx' in post.dirty for post in changed)
+        for goods_type, goods_key in ((2, 'product'), (3, 'armor')):
+            capacity_key = goods_key + '_capacity'
+            arrays = self.post_arrays.get(goods_type)
+            if rebuild or arrays is None:
+                selected = [post for post in self.posts.values() if post.type == goods_type]
+                arrays = (array([post.point_idx for post in selected], dtype=int),
+                          array([post[goods_key] for post in selected], dtype=int),
+                          array([post[capacity_key] for post in selected], dtype=int),
+                          array([post.replenishment for post in selected], dtype=int),
+                          dict((post.point_idx, row) for row, post in enumerate(selected)))
+            else:
+                points, stock, capacity, replenishment, rows = arrays
+                updated = [post for post in changed if post.point_idx in rows]
+                if updated:
+                    stock, capacity, replenishment = stock.copy(), capacity.copy(), replenishment.copy()
+                    for post in updated:
+                        row = rows[post.point_idx]
+                        stock[row], capacity[row] = post[goods_key], post[capacity_key]
+                        replenishment[row] = post.replenishment
+                    arrays = points, stock, capacity, replenishment, rows
+            self.post_arrays[goods_type] = arrays
+        self.goods_posts = dict((goods_type, arrays[:4]) for goods_type, arrays in self.post_arrays.items())
+
+    def get_goods_posts(self, goods_type):
+        """Returns posts with goods of the type as arrays in the order of self.posts.
+
+        :param goods_type: int - 2 for markets with product, 3 for storages with armor; empty arrays are returned for
+        any other type, e.g. None for a train keeping goods after its route was reset
+        :return: tuple - 4-tuple of numpy arrays: points indexes, goods, goods capacities and replenishments of posts
+        """
+        posts = self.goods_posts.get(goods_type)
+        if posts is None:
+            posts = tuple(array([], dtype=int) for _ in xrange(4))
+        return posts
+
+    def get_mined(self, trips):
+        """Returns amounts of goods expected to be mined by trains finishing their trips earlier than each of trips.
+
+        :param trips: numpy.ndarray - trip lengths
+        :return: numpy.ndarray - amounts of goods
+        """
+        expected = [(goods['trip'], goods['amount']) for goods in self.expected_goods.values() if goods['trip']]
+        if not expected:
+            return 0
+        expected_trips, amounts = array(expected, dtype=int).T
+        order = argsort(expected_trips, kind='mergesort')
+        mined = concatenate(([0], cumsum(amounts[order])))
+        return mined[searchsorted(expected_trips[order], trips, side='left')]
+
+    @profiled('get_direction')
     def get_direction(self, train_idx, exclude_points=None, exclude_lines=None):
         """Returns new train moving attributes. Excludes points from exclude_points and lines from exclude_lines.
 
@@ -409,14 +815,25 @@ class Bot(object):
         :return: tuple - 3-tuple: line_idx, position, speed. line_idx: int - line index, position: int - position
         within the line, speed: int - speed value
         """
+        self.goods_manager(train_idx, exclude_points=exclude_points, exclude_lines=exclude_lines)
+        return self.follow_route(train_idx)
+
+    def follow_route(self, train_idx):
+        """Returns train moving attributes continuing the current route of the train without planning a new one.
+
+        If the route is empty or the train has reached its end - returns current train line index and position with
+        speed 0.
+        :param train_idx: int - train index
+        :return: tuple - 3-tuple: line_idx, position, speed. line_idx: int - line index, position: int - position
+        within the line, speed: int - speed value
+        """
         position = self.trains[train_idx]['position']
         line_length = self.lines[self.trains[train_idx]['line_idx']]['length']
-        self.goods_manager(train_idx, exclude_points=exclude_points, exclude_lines=exclude_lines)
         route = self.expected_goods[train_idx]['route']
-        if route and len(route) > 1:
-            current_point = self.get_current_point(train_idx)
+        current_point = self.get_current_point(train_idx) if route else None
+        if route and current_point in route[:-1]:
             route_point = route.index(current_point)
-            line_idx = self.adjacent[route[route_point]][route[route_point + 1]]
+            line_idx = self.graph.line(route[route_point], route[route_point + 1])
             speed = 1 if current_point == self.lines[line_idx]['points'][0] else -1
             if position == 0 or position == line_length:
                 position = 1 if speed == 1 else self.lines[line_idx]['length'] - 1
@@ -428,6 +845,7 @@ class Bot(object):
             speed = 0
         return line_idx, position, speed
 
+    @profiled('check_collision')
     def check_collision(self, train_idx, line_idx, position, speed):
         """Returns a new direction for a train if there might be collision in the next position.
 
@@ -439,44 +857,85 @@ class Bot(object):
         within the line, speed: int - speed value
         """
         current_line_idx, current_position = self.trains[train_idx]['line_idx'], self.trains[train_idx]['position']
-        occupied_lines, occupied_points = {}, []
-        for idx, coordinates in self.occupied.items():
-            start_point = self.lines[coordinates['line_idx']]['points'][0]
-            end_point = self.lines[coordinates['line_idx']]['points'][1]
-            length = self.lines[coordinates['line_idx']]['length']
-            if idx == train_idx:
-                continue
-            if self.trains[train_idx]['player_idx'] == self.player_idx:
-                future_position = coordinates['position']
-            else:
-                future_position = coordinates['position'] + self.trains[train_idx]['speed']
-            if start_point in self.posts.keys() and self.posts[start_point]['type'] == 1 and future_position == 0:
-                continue
-            if end_point in self.posts.keys() and self.posts[end_point]['type'] == 1 and future_position == length:
-                continue
-            if coordinates['line_idx'] not in occupied_lines.keys():
-                occupied_lines[coordinates['line_idx']] = set()
-            occupied_lines[coordinates['line_idx']].add(future_position)
-            if future_position == 0:
-                occupied_points.append(start_point)
-            if future_position == length:
-                occupied_points.append(end_point)
         if position == 0 or position == self.lines[line_idx]['length']:
             point = self.lines[line_idx]['points'][0] if position == 0 else self.lines[line_idx]['points'][1]
         else:
             point = None
-        if line_idx in occupied_lines.keys() and position in occupied_lines[line_idx] and not point:
-            if current_position == 0 or current_position == self.lines[current_line_idx]['length']:
+        entering = current_position == 0 or current_position == self.lines[current_line_idx]['length']
+        if point is None and self.line_blocked(train_idx, line_idx, position, speed, entering):
+            if entering:
                 busy_lines = [line_idx]
-                while line_idx in occupied_lines.keys() and position in occupied_lines[line_idx]:
+                while self.line_blocked(train_idx, line_idx, position, speed, True):
+                    if self.out_of_budget():
+                        line_idx, position, speed = current_line_idx, current_position, 0
+                        break
                     line_idx, position, speed = self.get_direction(train_idx, exclude_lines=busy_lines)
+                    if line_idx in busy_lines:
+                        break
                     busy_lines.append(line_idx)
             else:
                 line_idx, position, speed = current_line_idx, current_position, 0
-        if point in occupied_points:
+        if point is not None and self.occupancy.point_busy(point, train_idx):
             line_idx, position, speed = current_line_idx, current_position, 0
         return line_idx, position, speed
 
+    def line_blocked(self, train_idx, line_idx, position, speed, ahead=False):
+        """Returns True if another train occupies the position of the next tick or, if ahead is True, a position the
+        train passes till the end of the line is reserved by another train for the tick the train passes it.
+
+        Only a train entering a line looks ahead: a train in the middle of a line can stop on any tick, while a train
+        having entered a line against another one can only wait for it.
+        :param train_idx: int - train index
+        :param line_idx: int - line index
+        :param position: int - position within the line of the next tick
+        :param speed: int - speed value
+        :param ahead: bool - check reservations of the ticks after the next one, default is False
+        :return: bool
+        """
+        if self.occupancy.line_busy(line_idx, position, train_idx):
+            return True
+        if ahead:
+            line = self.lines[line_idx]
+            for tick, position in self.line_ahead(line_idx, position, speed):
+                if position == 0 or position == line['length']:
+                    point = line['points'][0] if position == 0 else line['points'][1]
+                    if self.occupancy.point_busy(point, train_idx, tick):
+                        return True
+                elif self.occupancy.line_busy(line_idx, position, train_idx, tick):
+                    return True
+        return False
+
+    def line_ahead(self, line_idx, position, speed):
+        """Returns positions the train passes till the end of the line on RESERVED_TICKS ticks after the next one.
+
+        :param line_idx: int - line index
+        :param position: int - position within the line of the next tick
+        :param speed: int - speed value
+        :return: list - 2-tuples: tick number and position within the line
+        """
+        length, ahead = self.lines[line_idx]['length'], []
+        for tick in xrange(self.current_tick + 2, self.current_tick + 2 + self.RESERVED_TICKS):
+            if speed == 0 or position == 0 or position == length:
+                break
+            position += speed
+            ahead.append((tick, position))
+        return ahead
+
+    def reserve_line(self, train_idx, line_idx, position, speed):
+        """Reserves positions the train passes till the end of the line for ticks after the next one replacing its
+        previous reservations.
+
+        :param train_idx: int - train index
+        :param line_idx: int - line index
+        :param position: int - position within the line of the next tick
+        :param speed: int - speed value
+        :return: None
+        """
+        self.occupancy.cancel(train_idx)
+        for tick, position in self.line_ahead(line_idx, position, speed):
+            self.occupancy.reserve(train_idx, tick, line_idx, position)
+
+    @profiled('goods_manager')
     def goods_manager(self, train_idx, exclude_points=None, exclude_lines=None):
         """Assigns goods type to be mined by a train.
 
@@ -520,11 +979,12 @@ class Bot(object):
             else:
                 self.expected_goods[train_idx] = {'type': None, 'amount': None, 'trip': None, 'route': None}
 
+    @profiled('upgrade')
     def upgrade(self):
-        """Upgrades trains and town."""
+        """Enqueues upgrade of trains and town."""
         trains, towns, trains_to_upgrade = [], [], []
         available_armor = self.town['armor'] * 0.5
-        player_trains = [train for train in self.trains.values() if train['player_idx'] == self.player_idx]
+        player_trains = self.world.player_trains(self.player_idx)
         for train in player_trains:
             line = self.lines[train['line_idx']]
             if line['points'][0] == self.town['point_idx'] and train['position'] == 0:
@@ -538,4 +998,51 @@ class Bot(object):
         if not trains_to_upgrade and self.town['next_level_price'] and self.town['next_level_price'] <= available_armor:
             towns.append(self.town['idx'])
             available_armor -= self.town['next_level_price']
-        self.client.upgrade(towns, trains)
+        self.pipeline.upgrade(towns, trains)
+
+
+def main():
+    """Parses command line arguments and plays a game without GUI."""
+    parser = ArgumentParser(description='Plays the game by the bot without GUI.')
+    parser.add_argument('--host', default='wgforge-srv.wargaming.net')
+    parser.add_argument('--port', type=int, default=443)
+    parser.add_argument('--timeout', type=int, default=20)
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--password')
+    parser.add_argument('--game', help='game title to connect to or create')
+    parser.add_argument('--players', type=int, help='number of players in the game')
+    parser.add_argument('--turns', type=int, help='number of turns of the game')
+    parser.add_argument('--routing', choices=sorted(Bot.ROUTING), help='routing preprocessing')
+    parser.add_argument('--geometry', action='store_true', help='use point coordinates as distance lower bounds')
+    parser.add_argument('--budget', type=float, help='planning seconds per tick')
+    parser.add_argument('--quiet', action='store_true', help='do not print status')
+    parser.add_argument('--profile', type=float, metavar='MS',
+                        help='times phases of ticks and dumps hot stacks of ticks longer than MS milliseconds')
+    args = parser.parse_args()
+
+    def status(value):
+        print value
+
+    profiler = TickProfiler(threshold=args.profile / 1000.0) if args.profile is not None else None
+    bot = Bot(routing=args.routing, geometry=args.geometry, budget=args.budget,
+              queue=EventSink(status=None if args.quiet else status), profiler=profiler)
+    try:
+        bot.start(host=args.host, port=args.port, time_out=args.timeout, username=args.username,
+                  password=args.password, game=args.game, num_players=args.players, num_turns=args.turns)
+    except KeyboardInterrupt:
+        bot.stop()
+    finally:
+        bot.close()
+    if bot.player_idx in bot.ratings:
+        print 'Tick {}, rating {}'.format(bot.current_tick, bot.ratings[bot.player_idx]['rating'])
+    if profiler is not None:
+        profiler.close()
+        snapshot = profiler.snapshot()
+        for phase, stats in sorted(snapshot['phases'].items()):
+            print '{}: p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms'.format(phase, stats['p50'] * 1000,
+                                                                         stats['p99'] * 1000, stats['max'] * 1000)
+        print ', '.join('{} {}'.format(name, value) for name, value in sorted(snapshot['counters'].items()))
+
+
+if __name__ == '__main__':
+    main()
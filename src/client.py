@@ -2,9 +2,31 @@
 # -*- coding: utf-8 -*-
 """The module implements client for communication with game server by it's protocol."""
 import socket
+from collections import deque
 from functools import wraps
+from importlib import import_module
 from json import dumps, loads
-from struct import pack, unpack
+from struct import Struct
+from time import time
+
+HEADER = Struct('<ii')
+EMPTY_FRAMES = dict((action, HEADER.pack(action, 0)) for action in (2, 5, 6, 7))
+MAP_FRAMES = dict((layer, HEADER.pack(10, len(dumps({'layer': layer}))) + dumps({'layer': layer}))
+                  for layer in (0, 1, 10))
+
+
+def fastest_decoder(modules=('ujson', 'simplejson')):
+    """Returns loads function of the first importable JSON module falling back to the standard json module.
+
+    :param modules: tuple - names of JSON modules in order of preference
+    :return: function - JSON decoder
+    """
+    for name in modules:
+        try:
+            return import_module(name).loads
+        except ImportError:
+            continue
+    return loads
 
 
 def connection(func):
@@ -33,6 +55,9 @@ class Response(object):
         5: 'TIMEOUT',
         500: 'INTERNAL_SERVER_ERROR'
     }
+    decoder = staticmethod(fastest_decoder())
+    tracer = None
+    key = None
 
     def __init__(self, status, length, data):
         """Creates an object representing server response.
@@ -44,12 +69,151 @@ class Response(object):
         self.status = self.STATUS[status]
         self.length = length
         self.data = data if data != '' else ''
+        self._json = None
+
+    @property
+    def json(self):
+        """Returns response body decoded on first access. The decoded object is cached and shared by all readers.
+
+        :return: dict or None if the body is empty
+        """
+        if self._json is None and self.data != '':
+            if self.tracer is None:
+                self._json = self.decoder(self.data)
+            else:
+                started = time()
+                self._json = self.decoder(self.data)
+                self.tracer.decoded(self.key, time() - started)
+        return self._json
+
+    @classmethod
+    def set_decoder(cls, decoder):
+        """Replaces JSON decoder used by all responses.
+
+        :param decoder: function - function taking JSON string and returning decoded object
+        :return: None
+        """
+        cls.decoder = staticmethod(decoder)
+
+
+class DynamicLayer(object):
+    """Remembers the previous dynamic layer snapshot and computes changes of trains and posts between snapshots."""
+    KINDS = ('posts', 'trains')
+
+    def __init__(self):
+        """Creates tracker with an empty previous snapshot, so the first snapshot is reported as added objects."""
+        self.previous = dict((kind, {}) for kind in self.KINDS)
+
+    def diff(self, dynamic_objects):
+        """Compares the snapshot with the previous one and remembers it.
+
+        :param dynamic_objects: dict - decoded dynamic layer
+        :return: dict - layer idx, ratings and for posts and trains a dict with keys: added - dict of new objects by
+        idx, changed - dict of changed fields dicts by idx, removed - list of removed objects indexes
+        """
+        delta = {'idx': dynamic_objects['idx'], 'ratings': dynamic_objects['ratings']}
+        for kind in self.KINDS:
+            previous, current, added, changed = self.previous[kind], {}, {}, {}
+            for obj in dynamic_objects[kind]:
+                idx = obj['idx']
+                current[idx] = obj
+                old = previous.get(idx)
+                if old is None:
+                    added[idx] = obj
+                    continue
+                fields = dict((key, value) for key, value in obj.iteritems() if key not in old or old[key] != value)
+                if fields:
+                    changed[idx] = fields
+            removed = [idx for idx in previous if idx not in current]
+            self.previous[kind] = current
+            delta[kind] = {'added': added, 'changed': changed, 'removed': removed}
+        return delta
+
+
+class Pipeline(object):
+    """Accumulates MOVE, UPGRADE and TURN requests of a turn to send them to the server in one go."""
+
+    def __init__(self, client):
+        """Creates an empty pipeline.
+
+        :param client: Client instance - client the requests are executed by
+        """
+        self.client = client
+        self.requests = []
+
+    def __len__(self):
+        """Returns number of pending requests."""
+        return len(self.requests)
+
+    def move_train(self, line_idx, speed, train_idx):
+        """Enqueues MOVE request. Parameters are the same as in Client.move_train.
+
+        :return: Pipeline instance
+        """
+        self.requests.append((3, {'line_idx': line_idx, 'speed': speed, 'train_idx': train_idx}))
+        return self
+
+    def upgrade(self, posts=None, trains=None):
+        """Enqueues UPGRADE request. Parameters are the same as in Client.upgrade.
+
+        :return: Pipeline instance
+        """
+        posts = posts if posts is not None else []
+        trains = trains if trains is not None else []
+        self.requests.append((4, {'posts': posts, 'trains': trains}))
+        return self
+
+    def turn(self):
+        """Enqueues TURN request.
+
+        :return: Pipeline instance
+        """
+        self.requests.append((5, None))
+        return self
+
+    def send(self):
+        """Sends pending requests without waiting for responses and clears the pipeline.
+
+        :return: list - sent requests to be passed to receive
+        """
+        requests, self.requests = self.requests, []
+        self.client.submit(requests)
+        return requests
+
+    def receive(self, requests):
+        """Receives responses of sent requests.
+
+        If any request fails raises BatchError after all responses are received.
+        :param requests: list - requests returned by send
+        :return: list of Response instances in order of requests
+        """
+        return self.client.collect(requests)
+
+    def execute(self):
+        """Sends pending requests, receives their responses and clears the pipeline.
+
+        If any request fails raises BatchError after all responses are received.
+        :return: list of Response instances in order of requests
+        """
+        return self.receive(self.send())
 
 
 class Client(object):
     """Game server client main class."""
+    BUFFER_SIZE = 65536
+    ACTIONS = {
+        1: 'LOGIN',
+        2: 'LOGOUT',
+        3: 'MOVE',
+        4: 'UPGRADE',
+        5: 'TURN',
+        6: 'PLAYER',
+        7: 'GAMES',
+        10: 'MAP'
+    }
 
-    def __init__(self, host=None, port=None, timeout=None, username=None, password=None):
+    def __init__(self, host=None, port=None, timeout=None, username=None, password=None, tracer=None, recorder=None,
+                 transport=None):
         """Initiates client.
 
         :param host: str - server hostname or IP address
@@ -57,9 +221,20 @@ class Client(object):
         :param timeout: int - socket timeout
         :param username: string - username
         :param password: string - password
+        :param tracer: tracing.Tracer instance - collects requests statistics, None disables tracing
+        :param recorder: replay.Recorder instance - records requests and responses, None disables recording
+        :param transport: function - creates socket-like connection from address and timeout, e.g. replay.Replay
+        instance, default is socket.create_connection
         """
         self.host, self.port, self.timeout, self.username, self.password = host, port, timeout, username, password
         self.connection = None
+        self.tracer = tracer
+        self.recorder = recorder
+        self.transport = transport if transport is not None else socket.create_connection
+        self.traces = deque()
+        self.dynamic_layer = DynamicLayer()
+        self.buffer = bytearray(self.BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
 
     def connect(self):
         """Creates connection with game server. If host or port are None raises corresponding exceptions."""
@@ -67,12 +242,27 @@ class Client(object):
             raise HostMissing('host is missing')
         if self.port is None:
             raise PortMissing('port is missing')
-        self.connection = socket.create_connection((self.host, self.port), self.timeout)
+        self.connection = self.transport((self.host, self.port), self.timeout)
+        self.traces.clear()
 
     def close_connection(self):
         """Closes connection if it is opened."""
         if self.connection:
             self.connection.close()
+            self.connection = None
+
+    @staticmethod
+    def encode(action, body=None):
+        """Prepares request. Requests without body are taken ready from EMPTY_FRAMES.
+
+        :param action: int - action ID
+        :param body: dict - request body
+        :return: str - request ready to be sent
+        """
+        if body is None:
+            return EMPTY_FRAMES[action] if action in EMPTY_FRAMES else HEADER.pack(action, 0)
+        data = dumps(body)
+        return HEADER.pack(action, len(data)) + data
 
     @connection
     def send(self, action, body=None):
@@ -82,29 +272,130 @@ class Client(object):
         :param body: dict - request body
         :return: None
         """
-        if body is None:
-            request = pack('<i', action) + pack('<i', 0)
-        else:
-            data = dumps(body)
-            request = pack('<i', action) + pack('<i', len(data)) + data
+        request = self.encode(action, body)
+        if self.tracer is not None:
+            self.trace(action, body, len(request))
+        if self.recorder is not None:
+            self.recorder.request(request)
         self.connection.sendall(request)
 
+    @connection
+    def send_frame(self, frame):
+        """Sends prepared request.
+
+        :param frame: str - request ready to be sent
+        :return: None
+        """
+        if self.tracer is not None:
+            action, length = HEADER.unpack_from(frame)
+            self.trace(action, loads(frame[HEADER.size:]) if length else None, len(frame))
+        if self.recorder is not None:
+            self.recorder.request(frame)
+        self.connection.sendall(frame)
+
+    def trace(self, action, body, size):
+        """Records a request being sent and remembers when it is sent to measure its latency.
+
+        :param action: int - action ID
+        :param body: dict - request body
+        :param size: int - request size in bytes
+        :return: None
+        """
+        key = 'MAP:{}'.format(body['layer']) if action == 10 and body else self.ACTIONS.get(action, str(action))
+        self.tracer.request(key, size)
+        self.traces.append((key, time()))
+
+    @connection
+    def execute(self, requests):
+        """Sends requests in one go and receives their responses in order.
+
+        If any request fails raises BatchError after all responses are received, so the connection stays in sync.
+        :param requests: list - list of 2-tuples: action ID and request body
+        :return: list of Response instances in order of requests
+        """
+        self.submit(requests)
+        return self.collect(requests)
+
+    @connection
+    def submit(self, requests):
+        """Sends requests in one go without receiving responses. Call collect to receive them.
+
+        :param requests: list - list of 2-tuples: action ID and request body
+        :return: None
+        """
+        if not requests:
+            return
+        frames = [self.encode(action, body) for action, body in requests]
+        if self.tracer is not None:
+            for (action, body), frame in zip(requests, frames):
+                self.trace(action, body, len(frame))
+        if self.recorder is not None:
+            for frame in frames:
+                self.recorder.request(frame)
+        self.connection.sendall(''.join(frames))
+
+    @connection
+    def collect(self, requests):
+        """Receives responses of submitted requests in order.
+
+        If any request fails raises BatchError after all responses are received, so the connection stays in sync.
+        :param requests: list - list of 2-tuples: action ID and request body
+        :return: list of Response instances in order of requests
+        """
+        responses, errors = [], []
+        for request in requests:
+            try:
+                responses.append(self.receive())
+            except BadServerResponse as exc:
+                responses.append(None)
+                errors.append((request, exc))
+        if errors:
+            raise BatchError(errors, responses)
+        return responses
+
+    def pipeline(self):
+        """Creates a pipeline for sending requests of a turn in one go.
+
+        :return: Pipeline instance
+        """
+        return Pipeline(self)
+
     @connection
     def receive(self):
         """Receives server response.
 
         :return: Response instance
         """
-        status = unpack('<i', self.connection.recv(4))[0]
-        length = unpack('<i', self.connection.recv(4))[0]
-        data = ''
-        while len(data) < length:
-            chunk = self.connection.recv(length)
-            data += chunk
+        status, length = HEADER.unpack_from(self.read(HEADER.size))
+        response = Response(status, length, self.read(length).tobytes() if length else '')
+        if self.tracer is not None and self.traces:
+            response.key, started = self.traces.popleft()
+            response.tracer = self.tracer
+            self.tracer.response(response.key, time() - started, HEADER.size + length, response.status)
+        if self.recorder is not None:
+            self.recorder.response(HEADER.pack(status, length) + response.data)
         if status != 0:
-            message = loads(data)['error'] if data != '' else ''
-            raise BadServerResponse('{} {}'.format(Response.STATUS[status], message))
-        return Response(status, length, data)
+            message = response.json['error'] if response.data != '' else ''
+            raise BadServerResponse('{} {}'.format(response.status, message))
+        return response
+
+    def read(self, size):
+        """Reads exactly size bytes into the reusable buffer. The buffer is grown if it is too small.
+
+        :param size: int - number of bytes to read
+        :return: memoryview of the buffer with received bytes valid until the next read
+        """
+        if size > len(self.buffer):
+            self.buffer = bytearray(max(size, 2 * len(self.buffer)))
+            self.view = memoryview(self.buffer)
+        received = 0
+        while received < size:
+            count = self.connection.recv_into(self.view[received:size], size - received)
+            if not count:
+                self.close_connection()
+                raise ConnectionClosed('connection is closed by server')
+            received += count
+        return self.view[:size]
 
     def login(self, name=None, password=None, game=None, num_players=None, num_turns=None):
         """Sends LOGIN request and receives response. If name is missing throws UsernameMissing exception.
@@ -131,14 +422,17 @@ class Client(object):
         if num_turns is not None:
             body['num_turns'] = num_turns
         self.send(1, body)
-        return self.receive()
+        response = self.receive()
+        self.dynamic_layer = DynamicLayer()
+        return response
 
     def logout(self):
         """Sends LOGOUT request and receives response.
 
         :return: Response instance
         """
-        self.send(2)
+        self.send_frame(EMPTY_FRAMES[2])
+        self.traces.clear()
         self.connection.close()
 
     def move_train(self, line_idx, speed, train_idx):
@@ -170,7 +464,7 @@ class Client(object):
 
         :return: Response instance
         """
-        self.send(5)
+        self.send_frame(EMPTY_FRAMES[5])
         return self.receive()
 
     def player(self):
@@ -178,7 +472,7 @@ class Client(object):
 
         :return: Response instance
         """
-        self.send(6)
+        self.send_frame(EMPTY_FRAMES[6])
         return self.receive()
 
     def games(self):
@@ -186,7 +480,7 @@ class Client(object):
 
         :return: Response instance
         """
-        self.send(7)
+        self.send_frame(EMPTY_FRAMES[7])
         return self.receive()
 
     def get_static_objects(self):
@@ -194,7 +488,7 @@ class Client(object):
 
         :return: Response instance
         """
-        self.send(10, {'layer': 0})
+        self.send_frame(MAP_FRAMES[0])
         return self.receive()
 
     def get_dynamic_objects(self):
@@ -202,15 +496,23 @@ class Client(object):
 
         :return: Response instance
         """
-        self.send(10, {'layer': 1})
+        self.send_frame(MAP_FRAMES[1])
         return self.receive()
 
+    def get_dynamic_delta(self):
+        """Sends MAP request for dynamic objects and returns changes since the previous request.
+
+        The first request after login reports all objects as added.
+        :return: dict - changes computed by DynamicLayer.diff
+        """
+        return self.dynamic_layer.diff(self.get_dynamic_objects().json)
+
     def get_point_coordinates(self):
         """Sends MAP request for point coordinates and receives response.
 
         :return: Response instance
         """
-        self.send(10, {'layer': 10})
+        self.send_frame(MAP_FRAMES[10])
         return self.receive()
 
 
@@ -224,6 +526,11 @@ class ConnectionNotEstablished(ClientException):
     pass
 
 
+class ConnectionClosed(ClientException):
+    """Connection closed by server exception class."""
+    pass
+
+
 class HostMissing(ClientException):
     """Missing host exception class."""
     pass
@@ -242,3 +549,19 @@ class UsernameMissing(ClientException):
 class BadServerResponse(ClientException):
     """Bad server response exception class."""
     pass
+
+
+class BatchError(BadServerResponse):
+    """Failed requests of a batch exception class."""
+
+    def __init__(self, errors, responses):
+        """Creates exception describing every failed request.
+
+        :param errors: list - list of 2-tuples: failed request (action ID and body) and BadServerResponse instance
+        :param responses: list - list of Response instances in order of requests, None for failed requests
+        """
+        message = '; '.join('{} {}: {}'.format(Client.ACTIONS[action], body, exc.message)
+                            for (action, body), exc in errors)
+        super(BatchError, self).__init__(message)
+        self.errors = errors
+        self.responses = responses
@@ -43,14 +43,16 @@ class Graph(object):
     def __init__(self, source, weighted=False):
         """Deserializes *.json source into four attributes: name, idx, points, lines, and creates graph.
 
-        :param source: string - path to *.json file describing a graph or json string
+        :param source: string or dict - path to *.json file describing a graph, json string or already decoded dict
         :param weighted: boolean - creates weighted graph when True
         :return: None
         """
         self.source = source
         self.weighted = weighted
         self.graph = networkx.Graph()
-        if exists(str(self.source)):
+        if isinstance(self.source, dict):
+            raw_data = self.source
+        elif exists(str(self.source)):
             with open(expanduser(self.source)) as input_file:
                 raw_data = load(input_file)
         else:
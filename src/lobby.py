@@ -0,0 +1,154 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""The module implements lobby watcher polling available games in a background thread."""
+from socket import error
+from threading import Condition, Event, Thread
+
+from client import Client, ClientException
+
+
+class Lobby(Thread):
+    """Background thread keeping one connection open and polling GAMES.
+
+    Polling is adaptive: it is fast while somebody waits for a game state or right after games have changed, slows down
+    twice on every poll without changes up to max_interval and stops while there are neither listeners nor waiters.
+    Listeners are called from the lobby thread with the list of games names only when the names have changed.
+    """
+
+    def __init__(self, host=None, port=None, timeout=None, min_interval=0.1, max_interval=2.0, transport=None):
+        """Creates lobby watcher. Call start() to run it.
+
+        :param host: string - host
+        :param port: int - port
+        :param timeout: int - socket timeout
+        :param min_interval: float - polling interval in seconds used while waiting for a game state
+        :param max_interval: float - maximal polling interval in seconds
+        :param transport: function - creates client connection, default is a socket
+        """
+        super(Lobby, self).__init__(name='lobby')
+        self.daemon = True
+        self.client = Client(host=host, port=port, timeout=timeout, transport=transport)
+        self.min_interval, self.max_interval = min_interval, max_interval
+        self.interval = min_interval
+        self.condition = Condition()
+        self.wakeup = Event()
+        self.stopped = False
+        self.listeners = []
+        self.waiters = 0
+        self.games = None
+        self.error = None
+
+    @property
+    def address(self):
+        """Returns host, port and timeout of the lobby connection."""
+        return self.client.host, self.client.port, self.client.timeout
+
+    @property
+    def names(self):
+        """Returns list of cached games names or None if games haven't been received yet."""
+        games = self.games
+        return [game['name'] for game in games] if games is not None else None
+
+    def state(self, name):
+        """Returns cached state of the game.
+
+        :param name: string - game name
+        :return: int - game state or None if there is no such game
+        """
+        for game in self.games or ():
+            if game['name'] == name:
+                return game['state']
+        return None
+
+    def add_listener(self, listener):
+        """Subscribes to games changes. The listener is called at once if games are already known.
+
+        :param listener: function - takes list of games names
+        :return: None
+        """
+        with self.condition:
+            self.listeners.append(listener)
+            names = self.names
+        if names is not None:
+            listener(names)
+        self.wakeup.set()
+
+    def remove_listener(self, listener):
+        """Unsubscribes from games changes.
+
+        :param listener: function - previously added listener
+        :return: None
+        """
+        with self.condition:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def wait_for_state(self, name, state, timeout=None):
+        """Blocks until the game gets the state.
+
+        :param name: string - game name
+        :param state: int - game state
+        :param timeout: float - maximal waiting time in seconds, None means no limit
+        :return: bool - True if the game has got the state, False on timeout or when the lobby is stopped
+        """
+        with self.condition:
+            if self.state(name) == state:
+                return True
+            self.waiters += 1
+            self.interval = self.min_interval
+            self.wakeup.set()
+            try:
+                self.condition.wait(timeout)
+            finally:
+                self.waiters -= 1
+            return self.state(name) == state
+
+    def poll(self):
+        """Requests games once, updates the cache, wakes up waiters and notifies listeners if games names have changed.
+
+        :return: bool - True if games have changed
+        """
+        try:
+            if self.client.connection is None:
+                self.client.connect()
+            games = self.client.games().json['games']
+        except (ClientException, error) as exc:
+            self.client.close_connection()
+            self.error = exc
+            return False
+        self.error = None
+        with self.condition:
+            changed = games != self.games
+            names, self.games = self.names, games
+            listeners = list(self.listeners) if self.names != names else []
+            self.condition.notify_all()
+        for listener in listeners:
+            listener(self.names)
+        return changed
+
+    def run(self):
+        """Polls games until the lobby is stopped."""
+        while not self.stopped:
+            if not self.listeners and not self.waiters:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            changed = self.poll()
+            with self.condition:
+                if changed or self.waiters:
+                    self.interval = self.min_interval
+                else:
+                    self.interval = min(self.interval * 2, self.max_interval)
+                interval = self.interval
+            self.wakeup.wait(interval)
+            self.wakeup.clear()
+        self.client.close_connection()
+
+    def stop(self):
+        """Stops polling, wakes up waiters and closes the connection."""
+        self.stopped = True
+        self.wakeup.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self.is_alive():
+            self.join()
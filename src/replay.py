@@ -0,0 +1,205 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""The module implements recording of client sessions and their replay in place of the game server."""
+from argparse import ArgumentParser
+from collections import deque
+from json import dumps, loads
+from os.path import expanduser
+from struct import Struct
+from time import time
+
+from client import HEADER
+
+RECORD = Struct('<BdI')
+REQUEST, RESPONSE = 0, 1
+
+
+class Recorder(object):
+    """Appends every request and response frame with its timestamp to a file."""
+
+    def __init__(self, path):
+        """Opens the file for appending.
+
+        :param path: string - path to the recording file
+        """
+        self.path = path
+        self.output = open(expanduser(path), 'ab')
+
+    def write(self, direction, frame):
+        """Appends a frame.
+
+        :param direction: int - REQUEST or RESPONSE
+        :param frame: str - frame with header
+        :return: None
+        """
+        self.output.write(RECORD.pack(direction, time(), len(frame)) + frame)
+
+    def request(self, frame):
+        """Appends a request frame.
+
+        :param frame: str - request with header
+        :return: None
+        """
+        self.write(REQUEST, frame)
+
+    def response(self, frame):
+        """Appends a response frame and flushes the file, so a recording is complete up to the last response.
+
+        :param frame: str - response with header
+        :return: None
+        """
+        self.write(RESPONSE, frame)
+        self.output.flush()
+
+    def close(self):
+        """Closes the file."""
+        self.output.close()
+
+
+def read_records(path):
+    """Reads recorded frames.
+
+    :param path: string - path to the recording file
+    :return: generator of 3-tuples: direction, timestamp and frame; an incomplete last record is ignored
+    """
+    with open(expanduser(path), 'rb') as recording:
+        while True:
+            header = recording.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            direction, timestamp, length = RECORD.unpack(header)
+            frame = recording.read(length)
+            if len(frame) < length:
+                return
+            yield direction, timestamp, frame
+
+
+class Replay(object):
+    """Transport factory for Client feeding recorded responses back instead of connecting to a server.
+
+    Every connection continues the recording where the previous one stopped. Requests are matched to recorded ones by
+    action: recorded requests the client doesn't repeat are skipped, and MOVE and UPGRADE requests which are absent
+    from the recording are answered with empty OK responses, so replay stays aligned on TURN and MAP requests.
+    """
+    SKIPPABLE = (3, 4)
+    OK = HEADER.pack(0, 0)
+
+    def __init__(self, path):
+        """Loads recording and pairs requests with their responses.
+
+        :param path: string - path to the recording file
+        """
+        self.exchanges = deque()
+        games = []
+        requests = deque()
+        for direction, timestamp, frame in read_records(path):
+            if direction == REQUEST:
+                action = HEADER.unpack_from(frame)[0]
+                requests.append((action, timestamp))
+                game = loads(frame[HEADER.size:]).get('game') if action == 1 else None
+                if game is not None:
+                    games.append({'name': game, 'state': 2})
+                continue
+            while requests and requests[0][0] == 2:
+                requests.popleft()
+            action, sent = requests.popleft()
+            self.exchanges.append((action, frame, timestamp - sent))
+        body = dumps({'games': games})
+        self.games = HEADER.pack(0, len(body)) + body
+
+    def __call__(self, address, timeout=None):
+        """Creates socket replacement.
+
+        :param address: tuple - host and port, ignored
+        :param timeout: int - socket timeout, ignored
+        :return: ReplaySocket instance
+        """
+        return ReplaySocket(self)
+
+    def answer(self, action):
+        """Returns recorded response to the request.
+
+        :param action: int - action ID of the request
+        :return: str - response frame or None if the request gets no response or the recording is over
+        """
+        if action == 2:
+            return None
+        if action == 7 and (not self.exchanges or self.exchanges[0][0] != 7):
+            return self.games
+        while self.exchanges and self.exchanges[0][0] != action:
+            if action in self.SKIPPABLE:
+                return self.OK
+            self.exchanges.popleft()
+        return self.exchanges.popleft()[1] if self.exchanges else None
+
+
+class ReplaySocket(object):
+    """Socket replacement answering requests with recorded responses."""
+
+    def __init__(self, replay):
+        """Creates socket replacement.
+
+        :param replay: Replay instance - source of responses
+        """
+        self.replay = replay
+        self.incoming = ''
+        self.outgoing = ''
+
+    def sendall(self, data):
+        """Takes requests and prepares responses to them.
+
+        :param data: str - one or more request frames
+        :return: None
+        """
+        self.outgoing += data
+        while len(self.outgoing) >= HEADER.size:
+            action, length = HEADER.unpack_from(self.outgoing)
+            if len(self.outgoing) < HEADER.size + length:
+                break
+            self.outgoing = self.outgoing[HEADER.size + length:]
+            response = self.replay.answer(action)
+            if response is not None:
+                self.incoming += response
+
+    def recv_into(self, buffer, nbytes=0):
+        """Copies prepared responses into the buffer. Returns 0 once the recording is over, as a closed socket does.
+
+        :param buffer: memoryview or bytearray - destination buffer
+        :param nbytes: int - maximal number of bytes to copy
+        :return: int - number of copied bytes
+        """
+        count = min(nbytes or len(buffer), len(self.incoming))
+        buffer[:count] = self.incoming[:count]
+        self.incoming = self.incoming[count:]
+        return count
+
+    def close(self):
+        """Does nothing since there is no connection."""
+        pass
+
+
+def main():
+    """Replays a recording through the bot, optionally under profiler."""
+    parser = ArgumentParser(description='Replays a recorded client session through the bot.')
+    parser.add_argument('path', help='path to the recording file')
+    parser.add_argument('--game', help='game name the session was logged in to')
+    parser.add_argument('--profile', type=int, metavar='N', help='profiles the replay and prints N slowest functions')
+    args = parser.parse_args()
+
+    from bot import Bot
+    bot = Bot(transport=Replay(args.path))
+    kwargs = {'host': 'replay', 'port': 0, 'username': 'replay', 'game': args.game}
+    started = time()
+    if args.profile:
+        from cProfile import Profile
+        from pstats import Stats
+        profile = Profile()
+        profile.runcall(bot.start, **kwargs)
+        Stats(profile).sort_stats('cumulative').print_stats(args.profile)
+    else:
+        bot.start(**kwargs)
+    print('Replayed {} ticks in {:.3f} s'.format(bot.current_tick, time() - started))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,752 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""The module implements shortest paths search over the game map."""
+from abc import ABCMeta, abstractmethod
+from array import array as typed_array
+from heapq import heapify, heappop, heappush
+
+from numpy import arange, array, diff, frombuffer, full, inf, intc, lexsort, ones, repeat, uint8, where
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import shortest_path
+
+
+class CompactGraph(object):
+    """Undirected map in compressed sparse row form built once from lines.
+
+    Points and lines are numbered by rows and columns in order of their indexes. Edges of the row are slots from
+    offsets[row] to offsets[row + 1] of targets, line_columns and lengths arrays, each line giving a slot in the rows
+    of both its points. Parallel lines are kept, searches take the shortest one. The arrays are typed arrays of C ints:
+    they take 4 bytes per slot, their items are read as plain ints in search loops, and NumPy wraps them without
+    copying.
+    """
+
+    def __init__(self, lines):
+        """Builds the arrays.
+
+        :param lines: dict - line index to line attributes containing 'points' and 'length'
+        """
+        self.line_ids = sorted(lines)
+        self.line_index = dict((idx, column) for column, idx in enumerate(self.line_ids))
+        self.points = sorted(set(point for attrs in lines.values() for point in attrs['points']))
+        self.index = dict((point, row) for row, point in enumerate(self.points))
+        edges = [[] for _ in self.points]
+        for column, idx in enumerate(self.line_ids):
+            start_point, end_point = self.index[lines[idx]['points'][0]], self.index[lines[idx]['points'][1]]
+            edges[start_point].append((end_point, column, lines[idx]['length']))
+            edges[end_point].append((start_point, column, lines[idx]['length']))
+        offsets, targets, line_columns, lengths = [0], [], [], []
+        for row_edges in edges:
+            for target, column, length in row_edges:
+                targets.append(target)
+                line_columns.append(column)
+                lengths.append(length)
+            offsets.append(len(targets))
+        self.offsets, self.targets = typed_array('i', offsets), typed_array('i', targets)
+        self.line_columns, self.lengths = typed_array('i', line_columns), typed_array('i', lengths)
+        self.full = self.view()
+
+    def view(self, exclude_points=None, exclude_lines=None):
+        """Returns the graph without some points and lines. Only masks are allocated, the arrays are shared.
+
+        :param exclude_points: list - points to be excluded
+        :param exclude_lines: list - lines to be excluded
+        :return: GraphView instance
+        """
+        return GraphView(self, exclude_points, exclude_lines)
+
+    def line(self, point_from, point_to):
+        """Returns the shortest line between adjacent points.
+
+        :param point_from: int - point index
+        :param point_to: int - point index
+        :return: int - line index or None if the points are not adjacent
+        """
+        row, target = self.index[point_from], self.index[point_to]
+        slots = [slot for slot in xrange(self.offsets[row], self.offsets[row + 1]) if self.targets[slot] == target]
+        if not slots:
+            return None
+        return self.line_ids[self.line_columns[min(slots, key=lambda slot: (self.lengths[slot], slot))]]
+
+
+class GraphView(object):
+    """CompactGraph with excluded points and lines marked in boolean masks which searches check during traversal."""
+
+    def __init__(self, graph, exclude_points=None, exclude_lines=None):
+        """Creates masks.
+
+        :param graph: CompactGraph instance
+        :param exclude_points: list - points to be excluded
+        :param exclude_lines: list - lines to be excluded
+        """
+        self.graph = graph
+        self.excluded_points = frozenset(exclude_points or ())
+        self.excluded_lines = frozenset(exclude_lines or ())
+        self.point_mask = bytearray(len(graph.points))
+        self.line_mask = bytearray(len(graph.line_ids))
+        for point in self.excluded_points:
+            if point in graph.index:
+                self.point_mask[graph.index[point]] = 1
+        for idx in self.excluded_lines:
+            if idx in graph.line_index:
+                self.line_mask[graph.line_index[idx]] = 1
+
+    def __len__(self):
+        """Returns number of points of the graph including excluded ones."""
+        return len(self.graph.points)
+
+    def __contains__(self, point):
+        """Returns True if the point is not excluded and has at least one line which is not excluded."""
+        row = self.graph.index.get(point)
+        return row is not None and not self.point_mask[row] and any(True for _ in self.row_edges(row))
+
+    def row_edges(self, row):
+        """Yields edges of the row which are not excluded.
+
+        :param row: int - row of the point
+        :return: generator of 3-tuples: target row, line column and length
+        """
+        graph = self.graph
+        for slot in xrange(graph.offsets[row], graph.offsets[row + 1]):
+            target = graph.targets[slot]
+            if not self.point_mask[target] and not self.line_mask[graph.line_columns[slot]]:
+                yield target, graph.line_columns[slot], graph.lengths[slot]
+
+    def adjacent(self):
+        """Returns lengths of the shortest lines between adjacent points which are not excluded.
+
+        :return: dict - point index to dict of adjacent point index to length
+        """
+        adjacent, points = {}, self.graph.points
+        for row, point in enumerate(points):
+            if self.point_mask[row]:
+                continue
+            for target, _, length in self.row_edges(row):
+                lengths = adjacent.setdefault(point, {})
+                lengths[points[target]] = min(length, lengths.get(points[target], length))
+        return adjacent
+
+
+class ShortestPaths(object):
+    """Shortest paths tree from one point to all reachable points built by Dijkstra algorithm with binary heap.
+
+    One tree answers distance and path queries for any number of targets. Since the map is undirected, a tree built
+    from a point gives distances to the point as well.
+    """
+
+    def __init__(self, source, view):
+        """Builds the tree.
+
+        :param source: int - point index to build paths from
+        :param view: GraphView instance - graph to search over
+        """
+        self.source, self.graph = source, view.graph
+        self.row_to, self.dist_to = {}, {}
+        if source not in view:
+            return
+        offsets, targets, line_columns, lengths = view.graph.offsets, view.graph.targets, view.graph.line_columns, \
+            view.graph.lengths
+        point_mask, line_mask = view.point_mask, view.line_mask
+        dist_to, row_to = self.dist_to, self.row_to
+        heap = [(0, view.graph.index[source])]
+        tentative = {heap[0][1]: 0}
+        while heap:
+            dist, row = heappop(heap)
+            if row in dist_to:
+                continue
+            dist_to[row] = dist
+            for slot in xrange(offsets[row], offsets[row + 1]):
+                target = targets[slot]
+                if target in dist_to or point_mask[target] or line_mask[line_columns[slot]]:
+                    continue
+                new_dist = dist + lengths[slot]
+                if new_dist < tentative.get(target, float('inf')):
+                    tentative[target] = new_dist
+                    row_to[target] = row
+                    heappush(heap, (new_dist, target))
+
+    def __contains__(self, point):
+        """Returns True if the point is reachable from the source."""
+        return self.graph.index.get(point) in self.dist_to
+
+    @property
+    def point_to(self):
+        """Returns dict of previous points of the shortest paths."""
+        points = self.graph.points
+        return dict((points[row], points[previous]) for row, previous in self.row_to.items())
+
+    @property
+    def points_dist(self):
+        """Returns dict of lengths of the shortest paths to reachable points."""
+        points = self.graph.points
+        return dict((points[row], dist) for row, dist in self.dist_to.items())
+
+    def distance(self, target):
+        """Returns length of the shortest path to the target.
+
+        :param target: int - target point index
+        :return: int - path length or float('inf') if the target is unreachable
+        """
+        return self.dist_to.get(self.graph.index.get(target), float('inf'))
+
+    def distances(self, targets):
+        """Returns lengths of the shortest paths to the targets.
+
+        :param targets: list or numpy.ndarray - target points indexes
+        :return: numpy.ndarray - float lengths, inf for unreachable targets
+        """
+        return array([self.distance(target) for target in targets], dtype=float)
+
+    def path(self, target):
+        """Returns points of the shortest path from the source to the target.
+
+        :param target: int - target point index
+        :return: list - points indexes starting with the source and ending with the target or None if the target is
+        unreachable
+        """
+        if target not in self:
+            return None
+        points, row, source = [target], self.graph.index[target], self.graph.index[self.source]
+        while row != source:
+            row = self.row_to[row]
+            points.append(self.graph.points[row])
+        points.reverse()
+        return points
+
+
+class AllPairsPaths(object):
+    """Dense distance and predecessor matrices of all pairs of points computed once for a static graph view.
+
+    Rows of the matrices serve as shortest paths trees with the same interface as ShortestPaths, so a path query is
+    a walk over the predecessor row taking O(path length).
+    """
+
+    def __init__(self, view):
+        """Computes the matrices.
+
+        :param view: GraphView instance - graph to compute paths over
+        """
+        graph = view.graph
+        self.points, self.index = graph.points, graph.index
+        size = len(self.points)
+        self.dist, self.predecessors = None, None
+        if not size:
+            return
+        rows = repeat(arange(size), diff(frombuffer(graph.offsets, dtype=intc)))
+        columns, lengths = frombuffer(graph.targets, dtype=intc), frombuffer(graph.lengths, dtype=intc)
+        point_mask = frombuffer(bytes(view.point_mask), dtype=uint8).astype(bool)
+        line_mask = frombuffer(bytes(view.line_mask), dtype=uint8).astype(bool)
+        kept = ~(point_mask[rows] | point_mask[columns] | line_mask[frombuffer(graph.line_columns, dtype=intc)])
+        rows, columns, lengths = rows[kept], columns[kept], lengths[kept]
+        order = lexsort((lengths, columns, rows))
+        rows, columns, lengths = rows[order], columns[order], lengths[order]
+        shortest = ones(len(rows), dtype=bool)
+        shortest[1:] = (rows[1:] != rows[:-1]) | (columns[1:] != columns[:-1])
+        matrix = csr_matrix((lengths[shortest], (rows[shortest], columns[shortest])), shape=(size, size))
+        self.dist, self.predecessors = shortest_path(matrix, method='D', return_predecessors=True)
+
+    def tree(self, source):
+        """Returns shortest paths tree from the source.
+
+        :param source: int - point index
+        :return: PathsRow instance
+        """
+        return PathsRow(self, source)
+
+
+class PathsRow(object):
+    """Shortest paths tree from one point backed by a row of AllPairsPaths matrices."""
+
+    def __init__(self, paths, source):
+        """Takes the row of the source point.
+
+        :param paths: AllPairsPaths instance
+        :param source: int - point index to build paths from
+        """
+        self.source = source
+        self.points, self.index = paths.points, paths.index
+        row = self.index.get(source) if paths.dist is not None else None
+        self.dist_row = paths.dist[row] if row is not None else None
+        self.predecessors_row = paths.predecessors[row] if row is not None else None
+
+    def __contains__(self, point):
+        """Returns True if the point is reachable from the source."""
+        return self.dist_row is not None and point in self.index and self.dist_row[self.index[point]] != inf
+
+    def distance(self, target):
+        """Returns length of the shortest path to the target.
+
+        :param target: int - target point index
+        :return: int - path length or float('inf') if the target is unreachable
+        """
+        if target not in self:
+            return float('inf')
+        return int(self.dist_row[self.index[target]])
+
+    def distances(self, targets):
+        """Returns lengths of the shortest paths to the targets.
+
+        :param targets: list or numpy.ndarray - target points indexes
+        :return: numpy.ndarray - float lengths, inf for unreachable targets
+        """
+        if self.dist_row is None:
+            return full(len(targets), inf)
+        rows = array([self.index.get(target, -1) for target in targets], dtype=int)
+        return where(rows >= 0, self.dist_row[rows], inf)
+
+    def path(self, target):
+        """Returns points of the shortest path from the source to the target.
+
+        :param target: int - target point index
+        :return: list - points indexes starting with the source and ending with the target or None if the target is
+        unreachable
+        """
+        if target not in self:
+            return None
+        row = self.index[target]
+        points = [target]
+        while self.points[row] != self.source:
+            row = self.predecessors_row[row]
+            points.append(self.points[row])
+        points.reverse()
+        return points
+
+
+class ContractionHierarchy(object):
+    """Contraction hierarchy of a static adjacency answering point to point queries by bidirectional search.
+
+    Points are contracted one by one in the order of edge difference: a contracted point is removed from the remaining
+    graph and pairs of its neighbours get shortcut edges unless a witness path not longer than the shortcut exists.
+    Each point keeps only edges to points contracted later, so a query searches upwards from both ends and meets at
+    the highest point of the shortest path; points reached suboptimally from above are stalled. Shortcuts are
+    unpacked into original points by their middle points. Preprocessing time and memory stay near linear for road-like
+    maps.
+    """
+
+    def __init__(self, view, witness_limit=500):
+        """Contracts all points.
+
+        :param view: GraphView instance - graph to contract
+        :param witness_limit: int - maximal number of points settled by one witness search
+        """
+        self.witness_limit = witness_limit
+        self.up, self.middle, self.rank = {}, {}, {}
+        graph = view.adjacent()
+        contracted_neighbours, depth = dict((point, 0) for point in graph), dict((point, 0) for point in graph)
+        priorities = dict((point, self.priority(graph, point, 0, 0)) for point in graph)
+        order = [(priority, point) for point, priority in priorities.items()]
+        heapify(order)
+        while order:
+            priority, point = heappop(order)
+            if point in self.up or priority != priorities[point]:
+                continue
+            priority = priorities[point] = self.priority(graph, point, contracted_neighbours[point], depth[point])
+            if order and priority > order[0][0]:
+                heappush(order, (priority, point))
+                continue
+            for point_from, point_to, length in self.shortcuts(graph, point):
+                if length < graph[point_from].get(point_to, float('inf')):
+                    graph[point_from][point_to] = graph[point_to][point_from] = length
+                    self.middle[point_from, point_to] = self.middle[point_to, point_from] = point
+            self.rank[point] = len(self.rank)
+            self.up[point] = graph.pop(point)
+            for point_idx in self.up[point]:
+                del graph[point_idx][point]
+                contracted_neighbours[point_idx] += 1
+                depth[point_idx] = max(depth[point_idx], depth[point] + 1)
+            for point_idx in self.up[point]:
+                priorities[point_idx] = self.priority(graph, point_idx, contracted_neighbours[point_idx],
+                                                      depth[point_idx])
+                heappush(order, (priorities[point_idx], point_idx))
+
+    def shortcuts(self, graph, point):
+        """Returns shortcuts needed to contract the point.
+
+        :param graph: dict - remaining graph: point index to dict of adjacent point index to length
+        :param point: int - point index
+        :return: list - 3-tuples: point from, point to and shortcut length
+        """
+        shortcuts = []
+        neighbours = sorted(graph[point].items())
+        for number, (point_from, length_from) in enumerate(neighbours):
+            targets = dict((point_to, length_from + length_to) for point_to, length_to in neighbours[number + 1:])
+            if not targets:
+                continue
+            witnesses = self.witness_search(graph, point_from, point, max(targets.values()))
+            for point_to, length in targets.items():
+                if witnesses.get(point_to, float('inf')) > length:
+                    shortcuts.append((point_from, point_to, length))
+        return shortcuts
+
+    def witness_search(self, graph, source, avoided, max_dist):
+        """Searches distances from the source avoiding the point being contracted. The search is bounded by distance
+        and number of settled points, so some witnesses may be missed what only adds unnecessary shortcuts.
+
+        :param graph: dict - remaining graph: point index to dict of adjacent point index to length
+        :param source: int - point index
+        :param avoided: int - point index to be avoided
+        :param max_dist: int - maximal distance to search within
+        :return: dict - point index to distance
+        """
+        dist_to, heap = {}, [(0, source)]
+        while heap and len(dist_to) < self.witness_limit:
+            dist, point = heappop(heap)
+            if point in dist_to:
+                continue
+            dist_to[point] = dist
+            if dist >= max_dist:
+                break
+            for point_idx, length in graph[point].items():
+                if point_idx != avoided and point_idx not in dist_to and dist + length <= max_dist:
+                    heappush(heap, (dist + length, point_idx))
+        return dist_to
+
+    def priority(self, graph, point, contracted_neighbours, depth):
+        """Returns contraction priority of the point: doubled edge difference, i.e. number of needed shortcuts minus
+        number of removed edges, plus number of already contracted neighbours and depth of the point in the hierarchy.
+        The last two terms spread contraction uniformly over the map and keep the hierarchy shallow.
+
+        :param graph: dict - remaining graph: point index to dict of adjacent point index to length
+        :param point: int - point index
+        :param contracted_neighbours: int - number of contracted neighbours of the point
+        :param depth: int - length of the longest chain of contracted points below the point
+        :return: int - priority, lower is contracted earlier
+        """
+        return 2 * (len(self.shortcuts(graph, point)) - len(graph[point])) + contracted_neighbours + depth
+
+    def __contains__(self, point):
+        """Returns True if the point is a node of the adjacency."""
+        return point in self.up
+
+    def query(self, source, target):
+        """Finds the shortest path by bidirectional upward search.
+
+        :param source: int - point index to build path from
+        :param target: int - target point index
+        :return: 2-tuple: path length and list of points from the source to the target, float('inf') and None if the
+        target is unreachable
+        """
+        if source not in self.up or target not in self.up:
+            return float('inf'), None
+        if source == target:
+            return 0, [source]
+        dist_to, point_to = ({source: 0}, {target: 0}), ({}, {})
+        heaps = ([(0, source)], [(0, target)])
+        best, meeting = float('inf'), None
+        while heaps[0] or heaps[1]:
+            side = 0 if heaps[0] and (not heaps[1] or heaps[0][0] <= heaps[1][0]) else 1
+            if heaps[side][0][0] >= best:
+                heaps[side][:] = []
+                continue
+            dist, point = heappop(heaps[side])
+            if dist > dist_to[side][point]:
+                continue
+            if point in dist_to[1 - side] and dist + dist_to[1 - side][point] < best:
+                best, meeting = dist + dist_to[1 - side][point], point
+            adjacent_points = self.up[point].items()
+            if any(dist_to[side].get(point_idx, dist) + length < dist for point_idx, length in adjacent_points):
+                continue
+            for point_idx, length in adjacent_points:
+                if dist + length < dist_to[side].get(point_idx, float('inf')):
+                    dist_to[side][point_idx] = dist + length
+                    point_to[side][point_idx] = point
+                    heappush(heaps[side], (dist + length, point_idx))
+        if meeting is None:
+            return float('inf'), None
+        forward, point = [meeting], meeting
+        while point != source:
+            point = point_to[0][point]
+            forward.append(point)
+        forward.reverse()
+        backward, point = [], meeting
+        while point != target:
+            point = point_to[1][point]
+            backward.append(point)
+        hops = forward + backward
+        path = [source]
+        for point_from, point_to_idx in zip(hops, hops[1:]):
+            path.extend(self.unpack(point_from, point_to_idx))
+        return best, path
+
+    def unpack(self, point_from, point_to):
+        """Unpacks an edge of the hierarchy into original points.
+
+        :param point_from: int - point index
+        :param point_to: int - point index
+        :return: list - points after point_from up to point_to inclusive
+        """
+        path, stack = [], [(point_from, point_to)]
+        while stack:
+            point_from, point_to = stack.pop()
+            middle = self.middle.get((point_from, point_to))
+            if middle is None:
+                path.append(point_to)
+            else:
+                stack.append((middle, point_to))
+                stack.append((point_from, middle))
+        return path
+
+    def tree(self, source):
+        """Returns shortest paths from the source answered by queries on demand.
+
+        :param source: int - point index
+        :return: HierarchyPaths instance
+        """
+        return HierarchyPaths(self, source)
+
+
+class QueriedPaths(object):
+    """Shortest paths from one point with the same interface as ShortestPaths answered by point to point queries on
+    demand. Results are cached per target. Subclasses implement search.
+    """
+    __metaclass__ = ABCMeta
+
+    def __init__(self, source):
+        """Creates paths.
+
+        :param source: int - point index to build paths from
+        """
+        self.source = source
+        self.results = {}
+
+    @abstractmethod
+    def search(self, target):
+        """Finds the shortest path to the target.
+
+        :param target: int - target point index
+        :return: 2-tuple: path length and list of points, float('inf') and None if the target is unreachable
+        """
+
+    def query(self, target):
+        """Returns cached or searched path length and points.
+
+        :param target: int - target point index
+        :return: 2-tuple: path length and list of points
+        """
+        result = self.results.get(target)
+        if result is None:
+            result = self.results[target] = self.search(target)
+        return result
+
+    def __contains__(self, point):
+        """Returns True if the point is reachable from the source."""
+        return self.query(point)[1] is not None
+
+    def distance(self, target):
+        """Returns length of the shortest path to the target.
+
+        :param target: int - target point index
+        :return: int - path length or float('inf') if the target is unreachable
+        """
+        return self.query(target)[0]
+
+    def distances(self, targets):
+        """Returns lengths of the shortest paths to the targets.
+
+        :param targets: list or numpy.ndarray - target points indexes
+        :return: numpy.ndarray - float lengths, inf for unreachable targets
+        """
+        return array([self.distance(target) for target in targets], dtype=float)
+
+    def path(self, target):
+        """Returns points of the shortest path from the source to the target.
+
+        :param target: int - target point index
+        :return: list - points indexes starting with the source and ending with the target or None if the target is
+        unreachable
+        """
+        path = self.query(target)[1]
+        return list(path) if path is not None else None
+
+
+class HierarchyPaths(QueriedPaths):
+    """Shortest paths from one point backed by ContractionHierarchy queries."""
+
+    def __init__(self, hierarchy, source):
+        """Creates paths.
+
+        :param hierarchy: ContractionHierarchy instance
+        :param source: int - point index to build paths from
+        """
+        super(HierarchyPaths, self).__init__(source)
+        self.hierarchy = hierarchy
+
+    def search(self, target):
+        """Queries the hierarchy.
+
+        :param target: int - target point index
+        :return: 2-tuple: path length and list of points
+        """
+        return self.hierarchy.query(self.source, target)
+
+
+class Landmarks(object):
+    """Landmark A* (ALT) search over any view of a static graph.
+
+    Distances from a few landmarks chosen farthest from each other are computed once for the whole map. By triangle
+    inequality |d(landmark, target) - d(landmark, point)| is a lower bound of the distance from the point to the target,
+    and it stays a lower bound when points or lines are excluded, so A* guided by it finds shortest paths visiting a
+    small part of the map. Point coordinates scaled not to exceed any line length give one more lower bound.
+    """
+
+    def __init__(self, view, count=8, coordinates=None, counter=None):
+        """Chooses landmarks and computes distances from them.
+
+        :param view: GraphView instance - the whole graph, searches may exclude points and lines from it
+        :param count: int - number of landmarks
+        :param coordinates: dict - point index to 2-tuple of x and y coordinates, None disables geometric bound
+        :param counter: callable - called with 'landmarks' for every search and 'dijkstra' for every tree LandmarkPaths
+        build, e.g. tracing.TickProfiler.count, default is None
+        """
+        self.graph = graph = view.graph
+        self.counter = counter
+        self.landmarks, self.vectors = [], [()] * len(graph.points)
+        nearest = [float('inf')] * len(graph.points)
+        point = None
+        if graph.points:
+            dist_to = ShortestPaths(graph.points[0], view).dist_to
+            point = graph.points[max(dist_to, key=lambda row: (dist_to[row], -row))]
+        while point is not None and len(self.landmarks) < count:
+            dist_to = ShortestPaths(point, view).dist_to
+            self.landmarks.append(point)
+            for row in xrange(len(graph.points)):
+                dist = dist_to.get(row, float('inf'))
+                self.vectors[row] += (dist,)
+                nearest[row] = min(nearest[row], dist)
+            row = max(xrange(len(graph.points)), key=lambda row: (nearest[row], -row))
+            point = graph.points[row] if nearest[row] > 0 else None
+        self.coordinates, self.scale = coordinates, 0
+        if coordinates:
+            scales = []
+            for row in xrange(len(graph.points)):
+                for slot in xrange(graph.offsets[row], graph.offsets[row + 1]):
+                    euclidean = self.euclidean(row, graph.targets[slot])
+                    if euclidean:
+                        scales.append(graph.lengths[slot] / euclidean)
+            self.scale = min(scales) if scales else 0
+
+    def euclidean(self, row, target):
+        """Returns straight line distance between points by their coordinates.
+
+        :param row: int - row of the point
+        :param target: int - row of the point
+        :return: float - distance
+        """
+        points = self.graph.points
+        (x_point, y_point), (x_target, y_target) = self.coordinates[points[row]], self.coordinates[points[target]]
+        return ((x_point - x_target) ** 2 + (y_point - y_target) ** 2) ** 0.5
+
+    def bound(self, row, target):
+        """Returns lower bound of the distance between points.
+
+        :param row: int - row of the point
+        :param target: int - row of the point
+        :return: float - lower bound, float('inf') if the points are in different components of the map
+        """
+        bound = 0
+        for dist_point, dist_target in zip(self.vectors[row], self.vectors[target]):
+            if dist_point != dist_target:
+                if dist_point == float('inf') or dist_target == float('inf'):
+                    return float('inf')
+                bound = max(bound, abs(dist_point - dist_target))
+        if self.scale:
+            bound = max(bound, self.scale * self.euclidean(row, target))
+        return bound
+
+    def search(self, source, target, view):
+        """Finds the shortest path by A* search guided by landmarks bounds.
+
+        :param source: int - point index to build path from
+        :param target: int - target point index
+        :param view: GraphView instance - view of the graph the landmarks are computed for
+        :return: 2-tuple: path length and list of points from the source to the target, float('inf') and None if the
+        target is unreachable
+        """
+        if source not in view or target not in view:
+            return float('inf'), None
+        graph = self.graph
+        offsets, targets, line_columns, lengths = graph.offsets, graph.targets, graph.line_columns, graph.lengths
+        point_mask, line_mask = view.point_mask, view.line_mask
+        source, target = graph.index[source], graph.index[target]
+        dist_to, row_to, settled = {source: 0}, {}, set()
+        heap = [(self.bound(source, target), 0, source)]
+        while heap:
+            _, dist, row = heappop(heap)
+            if row == target:
+                path = [graph.points[target]]
+                while row != source:
+                    row = row_to[row]
+                    path.append(graph.points[row])
+                path.reverse()
+                return dist, path
+            if row in settled:
+                continue
+            settled.add(row)
+            for slot in xrange(offsets[row], offsets[row + 1]):
+                row_idx = targets[slot]
+                if point_mask[row_idx] or line_mask[line_columns[slot]]:
+                    continue
+                new_dist = dist + lengths[slot]
+                if new_dist < dist_to.get(row_idx, float('inf')):
+                    bound = self.bound(row_idx, target)
+                    if bound == float('inf'):
+                        continue
+                    dist_to[row_idx] = new_dist
+                    row_to[row_idx] = row
+                    heappush(heap, (new_dist + bound, new_dist, row_idx))
+        return float('inf'), None
+
+    def tree(self, source, view):
+        """Returns shortest paths from the source answered by searches on demand.
+
+        :param source: int - point index
+        :param view: GraphView instance - view of the graph the landmarks are computed for
+        :return: LandmarkPaths instance
+        """
+        return LandmarkPaths(self, source, view)
+
+
+class LandmarkPaths(QueriedPaths):
+    """Shortest paths from one point backed by Landmarks searches.
+
+    A search per target pays off for a few targets only: on a 30x30 grid with excluded lines a search to a random
+    target costs about a third of a full Dijkstra tree, on 100-point maps about 0.8 of it. So distances to more than
+    TREE_TARGETS targets at once are taken from one Dijkstra tree which answers later queries as well. Of the
+    check_collision detours only those of full trains to the town run A*, detours of other trains ask for distances to
+    all candidate posts of get_route and build the tree.
+    """
+    TREE_TARGETS = 2
+
+    def __init__(self, landmarks, source, view):
+        """Creates paths.
+
+        :param landmarks: Landmarks instance
+        :param source: int - point index to build paths from
+        :param view: GraphView instance - view of the graph to search over
+        """
+        super(LandmarkPaths, self).__init__(source)
+        self.landmarks, self.view = landmarks, view
+        self.tree = None
+
+    def search(self, target):
+        """Searches with landmarks bounds.
+
+        :param target: int - target point index
+        :return: 2-tuple: path length and list of points
+        """
+        if self.tree is not None:
+            return self.tree.distance(target), self.tree.path(target)
+        if self.landmarks.counter is not None:
+            self.landmarks.counter('landmarks')
+        return self.landmarks.search(self.source, target, self.view)
+
+    def distances(self, targets):
+        """Returns lengths of the shortest paths to the targets.
+
+        :param targets: list or numpy.ndarray - target points indexes
+        :return: numpy.ndarray - float lengths, inf for unreachable targets
+        """
+        if self.tree is None and len(targets) > self.TREE_TARGETS:
+            if self.landmarks.counter is not None:
+                self.landmarks.counter('dijkstra')
+            self.tree = ShortestPaths(self.source, self.view)
+        return super(LandmarkPaths, self).distances(targets)
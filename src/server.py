@@ -0,0 +1,725 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""The module implements local game server speaking the same protocol as the Client for offline testing."""
+import random
+from SocketServer import ThreadingTCPServer, BaseRequestHandler
+from Queue import Queue
+from argparse import ArgumentParser
+from json import dumps, load, loads
+from math import cos, sin, pi
+from os.path import expanduser
+from socket import IPPROTO_TCP, TCP_NODELAY, error
+from struct import pack, unpack
+from threading import Condition, Lock, Thread
+from time import time, sleep
+from uuid import uuid4
+
+INIT, RUN, FINISHED = 1, 2, 3
+TOWN, MARKET, STORAGE = 1, 2, 3
+TRAIN_COLLISION, HIJACKERS_ASSAULT, PARASITES_ASSAULT, REFUGEES_ARRIVAL, RESOURCE_OVERFLOW, RESOURCE_LACK = range(1, 7)
+GAME_OVER = 100
+OK, BAD_COMMAND, RESOURCE_NOT_FOUND, ACCESS_DENIED, NOT_READY = range(5)
+INTERNAL_SERVER_ERROR = 500
+
+TOWN_LEVELS = {
+    1: {'population_capacity': 10, 'product_capacity': 200, 'armor_capacity': 200, 'train_cooldown': 2,
+        'next_level_price': 100},
+    2: {'population_capacity': 20, 'product_capacity': 500, 'armor_capacity': 500, 'train_cooldown': 1,
+        'next_level_price': 200},
+    3: {'population_capacity': 40, 'product_capacity': 10000, 'armor_capacity': 10000, 'train_cooldown': 0,
+        'next_level_price': None}
+}
+TRAIN_LEVELS = {
+    1: {'goods_capacity': 40, 'next_level_price': 40},
+    2: {'goods_capacity': 80, 'next_level_price': 80},
+    3: {'goods_capacity': 160, 'next_level_price': None}
+}
+
+
+class ServerError(Exception):
+    """Request processing error which is sent to a client as an error response."""
+
+    def __init__(self, status, message):
+        """Creates an error with response status and message.
+
+        :param status: int - response status
+        :param message: string - error description
+        """
+        super(ServerError, self).__init__(message)
+        self.status = status
+
+
+class Map(object):
+    """Static layer of the game world: points, lines and their coordinates."""
+
+    def __init__(self, name, points, lines, coordinates, idx=1):
+        """Creates map.
+
+        :param name: string - map name
+        :param points: list - list of points dicts with idx and post_idx
+        :param lines: list - list of lines dicts with idx, length and points
+        :param coordinates: dict - point index to (x, y) tuple
+        :param idx: int - map index
+        """
+        self.name, self.idx, self.points, self.lines, self.coordinates = name, idx, points, lines, coordinates
+        self.lines_by_idx = dict((line['idx'], line) for line in lines)
+        self.incident = dict((point['idx'], []) for point in points)
+        for line in lines:
+            for point_idx in line['points']:
+                self.incident[point_idx].append(line)
+
+    @classmethod
+    def generate(cls, size, max_length=3, seed=None):
+        """Generates a grid map with size x size points and random line lengths.
+
+        :param size: int - number of points along a grid side
+        :param max_length: int - maximal line length
+        :param seed: int - random generator seed
+        :return: Map instance
+        """
+        rnd = random.Random(seed)
+        points, lines, coordinates = [], [], {}
+        for row in xrange(size):
+            for col in xrange(size):
+                idx = row * size + col + 1
+                points.append({'idx': idx, 'post_idx': None})
+                coordinates[idx] = (col * 50, row * 50)
+                if col:
+                    lines.append({'idx': len(lines) + 1, 'length': rnd.randint(1, max_length),
+                                  'points': [idx - 1, idx]})
+                if row:
+                    lines.append({'idx': len(lines) + 1, 'length': rnd.randint(1, max_length),
+                                  'points': [idx - size, idx]})
+        return cls('grid{}'.format(size), points, lines, coordinates)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a map from *.json file in the format of test_graphs.
+
+        :param path: string - path to *.json file
+        :return: Map instance
+        """
+        with open(expanduser(path)) as input_file:
+            raw_data = load(input_file)
+        points = [{'idx': point['idx'], 'post_idx': None} for point in raw_data['points']]
+        lines = [{'idx': line['idx'], 'length': line['length'], 'points': list(line['points'])}
+                 for line in raw_data['lines']]
+        coordinates = {}
+        for i, point in enumerate(points):
+            angle = 2 * pi * i / len(points)
+            coordinates[point['idx']] = (int(500 * cos(angle)), int(500 * sin(angle)))
+        return cls(raw_data.get('name', path), points, lines, coordinates, idx=raw_data.get('idx', 1))
+
+    def layer(self, layer):
+        """Returns a static layer as a dict ready to be serialized.
+
+        :param layer: int - 0 for points and lines, 10 for point coordinates
+        :return: dict
+        """
+        if layer == 0:
+            return {'idx': self.idx, 'name': self.name, 'points': self.points, 'lines': self.lines}
+        coordinates = [{'idx': idx, 'x': x, 'y': y} for idx, (x, y) in sorted(self.coordinates.items())]
+        width = max(x for x, _ in self.coordinates.values()) - min(x for x, _ in self.coordinates.values())
+        height = max(y for _, y in self.coordinates.values()) - min(y for _, y in self.coordinates.values())
+        return {'idx': self.idx, 'coordinates': coordinates, 'size': [width, height]}
+
+
+class Player(object):
+    """Registered player."""
+
+    def __init__(self, name, password):
+        """Creates player.
+
+        :param name: string - player's name
+        :param password: string - player's password
+        """
+        self.idx, self.name, self.password = str(uuid4()), name, password
+        self.game, self.town, self.trains, self.rating = None, None, [], 0
+
+
+class Game(object):
+    """Game session: dynamic state of the world and the rules advancing it."""
+
+    def __init__(self, name, world, num_players, num_turns, tick_interval, trains_per_player=8, events=True,
+                 seed=None):
+        """Creates a game on the given map.
+
+        :param name: string - game name
+        :param world: Map instance
+        :param num_players: int - number of players required to start the game
+        :param num_turns: int - game duration, -1 means infinite game
+        :param tick_interval: float - maximal turn duration in seconds
+        :param trains_per_player: int - number of trains of each player
+        :param events: bool - enables refugees, hijackers and parasites events
+        :param seed: int - random generator seed
+        """
+        self.name, self.map, self.num_players, self.num_turns = name, world, num_players, num_turns
+        self.tick_interval, self.trains_per_player, self.events = tick_interval, trains_per_player, events
+        self.random = random.Random(seed)
+        self.state, self.tick = INIT, 0
+        self.started_at, self.finished_at = None, None
+        self.turns = {}
+        self.condition = Condition(Lock())
+        self.players, self.connected, self.ready = [], set(), set()
+        self.posts, self.trains = {}, {}
+        self.points = dict((point['idx'], dict(point)) for point in world.points)
+        self.event_cooldowns = {}
+        self.create_posts()
+
+    def create_posts(self):
+        """Places towns, markets and storages on map points."""
+        towns = max(self.num_players, 4)
+        free_points = sorted(self.points.keys())
+        self.random.shuffle(free_points)
+        markets = max(len(free_points) / 8, 2)
+        storages = max(len(free_points) / 12, 1)
+        types = [TOWN] * towns + [MARKET] * markets + [STORAGE] * storages
+        for post_idx, (point_idx, post_type) in enumerate(zip(free_points, types), 1):
+            post = {'idx': post_idx, 'type': post_type, 'point_idx': point_idx, 'events': []}
+            if post_type == TOWN:
+                post.update({'name': 'town-{}'.format(post_idx), 'player_idx': None, 'level': 1, 'population': 3,
+                             'product': 300, 'armor': 100})
+                post.update(TOWN_LEVELS[1])
+            elif post_type == MARKET:
+                capacity = self.random.randint(100, 500)
+                post.update({'name': 'market-{}'.format(post_idx), 'product': capacity,
+                             'product_capacity': capacity, 'replenishment': self.random.randint(1, 5)})
+            else:
+                capacity = self.random.randint(50, 200)
+                post.update({'name': 'storage-{}'.format(post_idx), 'armor': capacity,
+                             'armor_capacity': capacity, 'replenishment': self.random.randint(1, 3)})
+            self.posts[point_idx] = post
+            self.points[point_idx]['post_idx'] = post_idx
+
+    def join(self, player):
+        """Assigns a free town and trains to a player. Starts the game once all players have joined.
+
+        :param player: Player instance
+        :return: None
+        """
+        if player in self.players:
+            self.connected.add(player.idx)
+            return
+        if self.state != INIT:
+            raise ServerError(ACCESS_DENIED, 'The game is already started')
+        town = next(post for post in self.posts.values() if post['type'] == TOWN and post['player_idx'] is None)
+        town['player_idx'] = player.idx
+        player.game, player.town, player.trains = self, town, []
+        line = self.map.incident[town['point_idx']][0]
+        position = 0 if line['points'][0] == town['point_idx'] else line['length']
+        for _ in xrange(self.trains_per_player):
+            idx = len(self.trains) + 1
+            train = {'idx': idx, 'player_idx': player.idx, 'line_idx': line['idx'], 'position': position, 'speed': 0,
+                     'goods': 0, 'goods_type': None, 'level': 1, 'cooldown': 0, 'events': []}
+            train.update(TRAIN_LEVELS[1])
+            self.trains[idx] = train
+            player.trains.append(train)
+        self.players.append(player)
+        self.connected.add(player.idx)
+        if len(self.players) == self.num_players:
+            self.state = RUN
+            self.started_at = time()
+            ticker = Thread(target=self.run)
+            ticker.daemon = True
+            ticker.start()
+
+    def leave(self, player):
+        """Marks player as disconnected so the game doesn't wait for its turns.
+
+        :param player: Player instance
+        :return: None
+        """
+        with self.condition:
+            self.connected.discard(player.idx)
+            if self.connected and self.connected <= self.ready:
+                self.advance()
+
+    def run(self):
+        """Advances the game every tick interval unless all players have already finished their turns."""
+        with self.condition:
+            while self.state == RUN:
+                tick, deadline = self.tick, time() + self.tick_interval
+                while self.tick == tick and self.state == RUN and time() < deadline:
+                    self.condition.wait(deadline - time())
+                if self.tick == tick and self.state == RUN:
+                    self.advance()
+
+    def turn(self, player):
+        """Ends player's turn and waits for the game to advance.
+
+        :param player: Player instance
+        :return: None
+        """
+        if self.state != RUN:
+            return
+        tick = self.tick
+        self.turns[player.idx] = self.turns.get(player.idx, 0) + 1
+        self.ready.add(player.idx)
+        if self.connected <= self.ready:
+            self.advance()
+        while self.tick == tick and self.state == RUN:
+            self.condition.wait(self.tick_interval)
+
+    def move(self, player, line_idx, speed, train_idx):
+        """Changes train's line and speed.
+
+        :param player: Player instance
+        :param line_idx: int - line index
+        :param speed: int - speed value
+        :param train_idx: int - train index
+        :return: None
+        """
+        if self.state != RUN:
+            raise ServerError(NOT_READY, 'The game is not running')
+        train = self.trains.get(train_idx)
+        if train is None:
+            raise ServerError(RESOURCE_NOT_FOUND, 'Train index not found: {}'.format(train_idx))
+        if train['player_idx'] != player.idx:
+            raise ServerError(ACCESS_DENIED, 'Train\'s owner mismatch')
+        if line_idx not in self.map.lines_by_idx:
+            raise ServerError(RESOURCE_NOT_FOUND, 'Line index not found: {}'.format(line_idx))
+        if speed not in (-1, 0, 1):
+            raise ServerError(BAD_COMMAND, 'Wrong speed value: {}'.format(speed))
+        if train['cooldown']:
+            raise ServerError(BAD_COMMAND, 'The train is under cooldown: {}'.format(train_idx))
+        if line_idx != train['line_idx']:
+            point_idx = self.get_point(train)
+            line = self.map.lines_by_idx[line_idx]
+            if point_idx is None or point_idx not in line['points']:
+                raise ServerError(BAD_COMMAND, 'The end of the train\'s line is not connected to the next line')
+            train['line_idx'] = line_idx
+            train['position'] = 0 if line['points'][0] == point_idx else line['length']
+        train['speed'] = speed
+
+    def upgrade(self, player, posts, trains):
+        """Upgrades player's town and trains paying with town's armor.
+
+        :param player: Player instance
+        :param posts: list - post indexes to upgrade
+        :param trains: list - train indexes to upgrade
+        :return: None
+        """
+        if self.state != RUN:
+            raise ServerError(NOT_READY, 'The game is not running')
+        town = player.town
+        objects = []
+        for post_idx in posts:
+            if post_idx != town['idx']:
+                raise ServerError(ACCESS_DENIED, 'The post can not be upgraded: {}'.format(post_idx))
+            objects.append((town, TOWN_LEVELS))
+        for train_idx in trains:
+            train = self.trains.get(train_idx)
+            if train is None or train['player_idx'] != player.idx:
+                raise ServerError(ACCESS_DENIED, 'The train can not be upgraded: {}'.format(train_idx))
+            if self.get_point(train) != town['point_idx']:
+                raise ServerError(BAD_COMMAND, 'The train is not in the town: {}'.format(train_idx))
+            objects.append((train, TRAIN_LEVELS))
+        price = sum(obj['next_level_price'] or 0 for obj, _ in objects)
+        if any(obj['next_level_price'] is None for obj, _ in objects) or price > town['armor']:
+            raise ServerError(BAD_COMMAND, 'Not enough armor resource for upgrade')
+        town['armor'] -= price
+        for obj, levels in objects:
+            obj['level'] += 1
+            obj.update(levels[obj['level']])
+
+    def get_point(self, train):
+        """Returns index of the point the train stands at or None if the train is between points.
+
+        :param train: dict - train
+        :return: int or None
+        """
+        line = self.map.lines_by_idx[train['line_idx']]
+        if train['position'] == 0:
+            return line['points'][0]
+        if train['position'] == line['length']:
+            return line['points'][1]
+        return None
+
+    def advance(self):
+        """Calculates the next turn of the game. Must be called with self.condition acquired."""
+        self.tick += 1
+        self.ready = set()
+        for post in self.posts.values():
+            post['events'] = [event for event in post['events'] if event['type'] == GAME_OVER]
+        for train in self.trains.values():
+            train['events'] = []
+            if train['cooldown']:
+                train['cooldown'] -= 1
+                continue
+            line = self.map.lines_by_idx[train['line_idx']]
+            train['position'] = min(max(train['position'] + train['speed'], 0), line['length'])
+            if train['position'] in (0, line['length']):
+                train['speed'] = 0
+        self.collide()
+        for train in self.trains.values():
+            point_idx = self.get_point(train)
+            if point_idx in self.posts and not train['cooldown']:
+                self.visit(train, self.posts[point_idx])
+        for post in self.posts.values():
+            if post['type'] == MARKET:
+                post['product'] = min(post['product'] + post['replenishment'], post['product_capacity'])
+            elif post['type'] == STORAGE:
+                post['armor'] = min(post['armor'] + post['replenishment'], post['armor_capacity'])
+            elif post['player_idx'] is not None:
+                self.feed(post)
+        for player in self.players:
+            town = player.town
+            player.rating = town['population'] * 1000 + town['product'] + town['armor'] + sum(
+                (level - 1) * 100 for level in [town['level']] + [train['level'] for train in player.trains])
+        if self.tick == self.num_turns or all(player.town['population'] == 0 for player in self.players):
+            self.state = FINISHED
+            self.finished_at = time()
+            for player in self.players:
+                player.town['events'].append({'type': GAME_OVER, 'tick': self.tick})
+        self.condition.notify_all()
+
+    def collide(self):
+        """Sends trains standing at the same place out of towns back home with their goods lost."""
+        places = {}
+        for train in self.trains.values():
+            if train['cooldown']:
+                continue
+            point_idx = self.get_point(train)
+            if point_idx is not None and point_idx in self.posts and self.posts[point_idx]['type'] == TOWN:
+                continue
+            place = point_idx if point_idx is not None else (train['line_idx'], train['position'])
+            places.setdefault(place, []).append(train)
+        for trains in places.values():
+            if len(trains) < 2:
+                continue
+            for train in trains:
+                town = next(player.town for player in self.players if player.idx == train['player_idx'])
+                line = self.map.incident[town['point_idx']][0]
+                train.update({'line_idx': line['idx'], 'speed': 0, 'goods': 0, 'goods_type': None,
+                              'position': 0 if line['points'][0] == town['point_idx'] else line['length'],
+                              'cooldown': town['train_cooldown']})
+                train['events'].append({'type': TRAIN_COLLISION, 'tick': self.tick,
+                                        'train': [other['idx'] for other in trains if other is not train][0]})
+
+    def visit(self, train, post):
+        """Loads goods from a market or a storage to a train or unloads the train in its home town.
+
+        :param train: dict - train
+        :param post: dict - post the train stands at
+        :return: None
+        """
+        if post['type'] == TOWN:
+            if post['player_idx'] != train['player_idx'] or not train['goods']:
+                return
+            resource = 'product' if train['goods_type'] == MARKET else 'armor'
+            post[resource] = min(post[resource] + train['goods'], post['{}_capacity'.format(resource)])
+            train['goods'], train['goods_type'] = 0, None
+            return
+        if train['goods_type'] not in (None, post['type']):
+            return
+        resource = 'product' if post['type'] == MARKET else 'armor'
+        amount = min(train['goods_capacity'] - train['goods'], post[resource])
+        if amount > 0:
+            post[resource] -= amount
+            train['goods'] += amount
+            train['goods_type'] = post['type']
+
+    def feed(self, town):
+        """Consumes town's product, applies random events and raises game over for the starving town.
+
+        :param town: dict - town post
+        :return: None
+        """
+        if town['population'] == 0:
+            return
+        if self.events:
+            self.happen(town)
+        town['product'] -= town['population']
+        if town['product'] < 0:
+            town['product'] = 0
+            town['population'] = max(town['population'] - 1, 0)
+            town['events'].append({'type': RESOURCE_LACK, 'tick': self.tick})
+        if town['population'] == 0:
+            town['events'].append({'type': GAME_OVER, 'tick': self.tick})
+
+    def happen(self, town):
+        """Applies refugees arrival, hijackers and parasites assaults according to their probabilities.
+
+        :param town: dict - town post
+        :return: None
+        """
+        for event_type, probability, power_range, period in ((REFUGEES_ARRIVAL, 0.5, (1, 2), 15),
+                                                             (HIJACKERS_ASSAULT, 0.25, (1, 10), 2),
+                                                             (PARASITES_ASSAULT, 0.25, (1, 10), 2)):
+            key = (town['idx'], event_type)
+            if self.event_cooldowns.get(key, 0) > self.tick or self.random.random() >= probability:
+                continue
+            power = self.random.randint(*power_range)
+            self.event_cooldowns[key] = self.tick + period * power
+            if event_type == REFUGEES_ARRIVAL:
+                town['population'] = min(town['population'] + power, town['population_capacity'])
+                town['events'].append({'type': event_type, 'tick': self.tick, 'refugees_number': power})
+            elif event_type == HIJACKERS_ASSAULT:
+                if town['armor'] >= power:
+                    town['armor'] -= power
+                else:
+                    town['population'] = max(town['population'] - power, 0)
+                town['events'].append({'type': event_type, 'tick': self.tick, 'hijackers_power': power})
+            else:
+                town['product'] = max(town['product'] - power, 0)
+                town['events'].append({'type': event_type, 'tick': self.tick, 'parasites_power': power})
+
+    def static_layer(self):
+        """Returns the static layer of the game world with posts placed on points.
+
+        :return: dict
+        """
+        layer = self.map.layer(0)
+        layer['points'] = [self.points[point['idx']] for point in self.map.points]
+        return layer
+
+    def dynamic_layer(self):
+        """Returns the dynamic layer of the game world.
+
+        :return: dict
+        """
+        ratings = dict((player.idx, {'idx': player.idx, 'name': player.name, 'rating': player.rating})
+                       for player in self.players)
+        return {'idx': self.map.idx, 'posts': self.posts.values(), 'trains': self.trains.values(), 'ratings': ratings}
+
+
+class RequestHandler(BaseRequestHandler):
+    """Serves a single client connection."""
+
+    def setup(self):
+        """Initiates connection state and starts a writer delaying responses by the server latency.
+
+        Nagle's algorithm is disabled, otherwise small responses wait for delayed acknowledgements of the client.
+        """
+        self.request.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        self.player = None
+        self.buffer = ''
+        self.received_at = time()
+        self.responses = Queue()
+        self.writer = Thread(target=self.write)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def handle(self):
+        """Reads requests and dispatches them to the game until the connection is closed."""
+        actions = {1: self.login, 2: self.logout, 3: self.move, 4: self.upgrade, 5: self.turn, 6: self.player_info,
+                   7: self.games, 10: self.map_layer}
+        while True:
+            request = self.read()
+            if request is None:
+                break
+            action, body, received_at = request
+            try:
+                if action not in actions:
+                    raise ServerError(BAD_COMMAND, 'Unknown action: {}'.format(action))
+                if action not in (1, 7) and self.player is None:
+                    raise ServerError(ACCESS_DENIED, 'Login required')
+                status, data = OK, actions[action](body)
+            except ServerError as exc:
+                status, data = exc.status, {'error': exc.message}
+            except (KeyError, TypeError, ValueError) as exc:
+                status, data = BAD_COMMAND, {'error': 'Wrong request body: {}'.format(exc)}
+            except Exception as exc:
+                status, data = INTERNAL_SERVER_ERROR, {'error': str(exc)}
+            if data is None:
+                data = ''
+            elif not isinstance(data, str):
+                data = dumps(data)
+            self.responses.put((received_at + self.server.latency, pack('<i', status) + pack('<i', len(data)) + data))
+            if action == 2:
+                break
+
+    def finish(self):
+        """Flushes responses and releases player's place in the game."""
+        self.responses.put(None)
+        self.writer.join()
+        if self.player and self.player.game:
+            self.player.game.leave(self.player)
+
+    def read(self):
+        """Reads a request and remembers when its last bytes arrived.
+
+        :return: 3-tuple: action, body dict or None, arrival time; or None if the connection is closed
+        """
+        while len(self.buffer) < 8 or len(self.buffer) < 8 + unpack('<i', self.buffer[4:8])[0]:
+            try:
+                chunk = self.request.recv(65536)
+            except error:
+                return None
+            if not chunk:
+                return None
+            self.buffer += chunk
+            self.received_at = time()
+        action, length = unpack('<ii', self.buffer[:8])
+        body = loads(self.buffer[8:8 + length]) if length else None
+        self.buffer = self.buffer[8 + length:]
+        return action, body, self.received_at
+
+    def write(self):
+        """Sends queued responses not earlier than their due time."""
+        while True:
+            item = self.responses.get()
+            if item is None:
+                return
+            due, response = item
+            delay = due - time()
+            if delay > 0:
+                sleep(delay)
+            try:
+                self.request.sendall(response)
+            except error:
+                return
+
+    def login(self, body):
+        """Logs a player in creating a new game or joining an existing one."""
+        player = self.server.get_player(body['name'], body.get('password'))
+        game = self.server.get_game(body.get('game', 'Game of {}'.format(player.name)),
+                                    body.get('num_players', 1), body.get('num_turns'))
+        if player.game is not None and player.game is not game and player.game.state != FINISHED:
+            raise ServerError(ACCESS_DENIED, 'The player is already in another game')
+        with game.condition:
+            game.join(player)
+            self.player = player
+            return dumps(self.get_player_info())
+
+    def logout(self, _):
+        """Logs a player out."""
+        return None
+
+    def move(self, body):
+        """Moves player's train."""
+        with self.player.game.condition:
+            self.player.game.move(self.player, body['line_idx'], body['speed'], body['train_idx'])
+
+    def upgrade(self, body):
+        """Upgrades player's town and trains."""
+        with self.player.game.condition:
+            self.player.game.upgrade(self.player, body.get('posts', []), body.get('trains', []))
+
+    def turn(self, _):
+        """Ends player's turn and waits for the next one."""
+        with self.player.game.condition:
+            self.player.game.turn(self.player)
+
+    def player_info(self, _):
+        """Returns player's info."""
+        with self.player.game.condition:
+            return dumps(self.get_player_info())
+
+    def get_player_info(self):
+        """Returns player's info dict. Must be called with the game condition acquired."""
+        player = self.player
+        return {'idx': player.idx, 'name': player.name, 'rating': player.rating, 'town': player.town,
+                'home': {'idx': player.town['point_idx'], 'post_idx': player.town['idx']}, 'trains': player.trains,
+                'in_game': player.game.state == RUN}
+
+    def games(self, _):
+        """Returns the list of games."""
+        return {'games': [{'name': game.name, 'num_players': game.num_players, 'num_turns': game.num_turns,
+                           'state': game.state} for game in self.server.games.values()]}
+
+    def map_layer(self, body):
+        """Returns a map layer."""
+        game = self.player.game
+        if body['layer'] == 1:
+            with game.condition:
+                return dumps(game.dynamic_layer())
+        if body['layer'] == 0:
+            return game.static_layer()
+        if body['layer'] == 10:
+            return game.map.layer(10)
+        raise ServerError(RESOURCE_NOT_FOUND, 'Layer not found: {}'.format(body['layer']))
+
+
+class Server(ThreadingTCPServer):
+    """Local game server."""
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, latency=0, tick_interval=10, size=10, map_path=None, num_turns=-1, trains=8,
+                 events=True, seed=None):
+        """Creates server bound to the address.
+
+        :param address: tuple - host and port; port 0 binds a free port
+        :param latency: float - artificial round trip time in seconds added to every response
+        :param tick_interval: float - maximal turn duration in seconds
+        :param size: int - side of a generated grid map, used when map_path is None
+        :param map_path: string - path to *.json map file
+        :param num_turns: int - default game duration, -1 means infinite game
+        :param trains: int - number of trains of each player
+        :param events: bool - enables refugees, hijackers and parasites events
+        :param seed: int - random generator seed
+        """
+        ThreadingTCPServer.__init__(self, address, RequestHandler)
+        self.latency, self.tick_interval, self.num_turns, self.trains = latency, tick_interval, num_turns, trains
+        self.events, self.seed = events, seed
+        self.map = Map.load(map_path) if map_path else Map.generate(size, seed=seed)
+        self.games, self.players = {}, {}
+        self.lock = Lock()
+
+    def get_player(self, name, password):
+        """Returns registered player or registers a new one.
+
+        :param name: string - player's name
+        :param password: string - player's password
+        :return: Player instance
+        """
+        with self.lock:
+            if name not in self.players:
+                self.players[name] = Player(name, password)
+            if self.players[name].password != password:
+                raise ServerError(ACCESS_DENIED, 'Password mismatch')
+            return self.players[name]
+
+    def get_game(self, name, num_players, num_turns):
+        """Returns a game with the name creating it if it doesn't exist or is finished.
+
+        :param name: string - game name
+        :param num_players: int - number of players
+        :param num_turns: int - game duration
+        :return: Game instance
+        """
+        with self.lock:
+            if name not in self.games or self.games[name].state == FINISHED:
+                num_turns = num_turns if num_turns is not None else self.num_turns
+                self.games[name] = Game(name, self.map, num_players, num_turns, self.tick_interval,
+                                        trains_per_player=self.trains, events=self.events, seed=self.seed)
+            return self.games[name]
+
+    def start(self):
+        """Serves requests in a background thread.
+
+        :return: 2-tuple of host and port the server is bound to
+        """
+        thread = Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self.server_address
+
+
+def main():
+    """Parses command line arguments and runs the server."""
+    parser = ArgumentParser(description='Local game server for offline bot testing.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0, help='round trip time in seconds')
+    parser.add_argument('--tick', type=float, default=10, help='maximal turn duration in seconds')
+    parser.add_argument('--size', type=int, default=10, help='side of a generated grid map')
+    parser.add_argument('--map', dest='map_path', help='path to *.json map file')
+    parser.add_argument('--turns', type=int, default=-1, help='default game duration')
+    parser.add_argument('--trains', type=int, default=8, help='number of trains of each player')
+    parser.add_argument('--no-events', dest='events', action='store_false')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    server = Server((args.host, args.port), latency=args.latency, tick_interval=args.tick, size=args.size,
+                    map_path=args.map_path, num_turns=args.turns, trains=args.trains, events=args.events,
+                    seed=args.seed)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""The module implements manager of many player sessions sharing one event loop and one thread."""
+import socket
+from time import time
+
+from async_client import AsyncClient, EventLoop, Future, Task
+
+
+class Session(object):
+    """Authenticated connection of a player."""
+
+    def __init__(self, client, game=None, num_players=None, num_turns=None):
+        """Creates session.
+
+        :param client: AsyncClient instance - client with username and password set
+        :param game: string - game name
+        :param num_players: int - number of players in the game
+        :param num_turns: int - number of turns (game duration)
+        """
+        self.client = client
+        self.game, self.num_players, self.num_turns = game, num_players, num_turns
+        self.player = None
+        self.checking = None
+
+    @property
+    def username(self):
+        """Returns player's name."""
+        return self.client.username
+
+    @property
+    def healthy(self):
+        """Returns True if the session is logged in and its connection is opened."""
+        return self.player is not None and self.client.connection is not None
+
+    def login(self, deadline=None):
+        """Connects if needed and logs the player in.
+
+        :param deadline: float - time in seconds since the epoch the request expires at
+        :return: Future instance resolved with the session
+        """
+        future = Future(deadline)
+
+        def logged_in(response):
+            try:
+                self.player = response.result().json
+            except Exception as exc:
+                self.player = None
+                future.set_exception(exc)
+            else:
+                future.set_result(self)
+
+        if self.client.connection is None:
+            try:
+                self.client.connect()
+            except socket.error as exc:
+                future.set_exception(exc)
+                return future
+        self.client.login(game=self.game, num_players=self.num_players, num_turns=self.num_turns,
+                          deadline=deadline).add_done_callback(logged_in)
+        return future
+
+
+class SessionManager(object):
+    """Owns authenticated sessions and a separate lobby connection served by one EventLoop.
+
+    Sessions are reused by username, checked with PLAYER request when idle and reconnected when broken.
+    """
+
+    def __init__(self, host, port, timeout=None, check_interval=30, loop=None):
+        """Creates manager.
+
+        :param host: string - host
+        :param port: int - port
+        :param timeout: int - default time in seconds given to each request
+        :param check_interval: float - idle time in seconds after which a session is health-checked
+        :param loop: EventLoop instance - loop serving connections, a new loop is created if None
+        """
+        self.host, self.port, self.timeout, self.check_interval = host, port, timeout, check_interval
+        self.loop = loop if loop is not None else EventLoop()
+        self.sessions = {}
+        self.lobby = AsyncClient(host=host, port=port, timeout=timeout, loop=self.loop)
+        self.last_check = time()
+
+    def __len__(self):
+        """Returns number of sessions."""
+        return len(self.sessions)
+
+    def open(self, username, password=None, game=None, num_players=None, num_turns=None, deadline=None):
+        """Returns logged in session of the player reusing an existing healthy one.
+
+        :param username: string - username
+        :param password: string - password
+        :param game: string - game name
+        :param num_players: int - number of players in the game
+        :param num_turns: int - number of turns (game duration)
+        :param deadline: float - time in seconds since the epoch the login expires at
+        :return: Future instance resolved with Session instance
+        """
+        session = self.sessions.get(username)
+        if session is not None and session.healthy and session.client.password == password and \
+                session.game == game:
+            future = Future()
+            future.set_result(session)
+            return future
+        if session is None:
+            client = AsyncClient(host=self.host, port=self.port, timeout=self.timeout, username=username,
+                                 password=password, loop=self.loop)
+            session = self.sessions[username] = Session(client, game, num_players, num_turns)
+        else:
+            session.client.password = password
+            session.game, session.num_players, session.num_turns = game, num_players, num_turns
+        return session.login(deadline)
+
+    def close(self, username):
+        """Logs the player out and forgets the session.
+
+        :param username: string - username
+        :return: None
+        """
+        session = self.sessions.pop(username, None)
+        if session is not None and session.client.connection is not None:
+            session.client.logout()
+
+    def close_all(self):
+        """Logs all players out, closes the lobby connection and flushes pending logouts."""
+        for username in self.sessions.keys():
+            self.close(username)
+        self.lobby.close_connection()
+        while any(client.outgoing for client in self.loop.clients):
+            self.loop.run_once(self.timeout)
+
+    def games(self, deadline=None):
+        """Requests games over the lobby connection which is not bound to any player.
+
+        :param deadline: float - time in seconds since the epoch the request expires at
+        :return: Future instance resolved with Response instance
+        """
+        return self.lobby.games(deadline=deadline)
+
+    def check(self, now=None):
+        """Health-checks idle sessions with PLAYER request and reconnects broken ones.
+
+        :param now: float - current time in seconds since the epoch
+        :return: None
+        """
+        now = now if now is not None else time()
+        self.last_check = now
+        for session in self.sessions.values():
+            if session.checking is not None and not session.checking.done():
+                continue
+            if session.client.connection is None:
+                session.checking = session.login(now + self.check_interval)
+            elif not session.client.pending and now - session.client.last_activity >= self.check_interval:
+                session.checking = Task(self._ping(session, now + self.check_interval))
+
+    @staticmethod
+    def _ping(session, deadline):
+        """Coroutine sending PLAYER request and relogging the session in if the request fails.
+
+        :param session: Session instance
+        :param deadline: float - time in seconds since the epoch the check expires at
+        :return: generator
+        """
+        try:
+            session.player = (yield session.client.player(deadline=deadline)).json
+        except Exception:
+            session.client.close_connection()
+            yield session.login(deadline)
+
+    def spawn(self, coroutine):
+        """Starts a coroutine driving sessions.
+
+        :param coroutine: generator - coroutine yielding Future instances
+        :return: Task instance
+        """
+        return self.loop.spawn(coroutine)
+
+    def run_once(self, timeout=None):
+        """Processes socket events and runs health checks when they are due.
+
+        :param timeout: float - maximal waiting time in seconds
+        :return: None
+        """
+        wait = max(self.last_check + self.check_interval - time(), 0)
+        self.loop.run_once(wait if timeout is None else min(timeout, wait))
+        if time() - self.last_check >= self.check_interval:
+            self.check()
+
+    def run_until_complete(self, future, timeout=None):
+        """Serves all sessions until the future is done and returns its result.
+
+        :param future: Future instance - future to wait for
+        :param timeout: float - maximal time in seconds to run, None means no limit
+        :return: result of the future
+        """
+        deadline = time() + timeout if timeout is not None else None
+        while not future.done() and (deadline is None or time() < deadline):
+            self.run_once(deadline - time() if deadline is not None else None)
+        return self.loop.run_until_complete(future, 0 if not future.done() else None)
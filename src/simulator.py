@@ -0,0 +1,225 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""The module implements in-process game simulator advancing the world in NumPy arrays by the rules of the server."""
+from numpy import add, arange, array, clip, full, maximum, minimum, searchsorted, unique, where, zeros
+
+TOWN, MARKET, STORAGE = 1, 2, 3
+
+
+class Simulator(object):
+    """Game world seeded from layer 0 lines and layer 1 posts and trains advanced tick by tick without a server.
+
+    Rules are the ones of server.Game: trains move along lines and stop at their ends, trains standing at the same
+    place out of towns are sent home with their goods lost, trains load goods at markets and storages and unload them
+    in their towns, markets and storages are replenished up to capacity and towns consume product by population.
+    Random town events and upgrades are not simulated. Objects are rows of arrays ordered by their indexes.
+    """
+
+    def __init__(self, lines, posts, trains):
+        """Creates the arrays.
+
+        :param lines: dict - line index to line attributes of layer 0
+        :param posts: list - posts of layer 1, dicts or world.Post instances
+        :param trains: list - trains of layer 1, dicts or world.Train instances
+        """
+        self.tick = 0
+        self.line_ids = sorted(lines)
+        self.line_index = dict((idx, column) for column, idx in enumerate(self.line_ids))
+        self.lengths = array([lines[idx]['length'] for idx in self.line_ids], dtype=int)
+        self.starts = array([lines[idx]['points'][0] for idx in self.line_ids], dtype=int)
+        self.ends = array([lines[idx]['points'][1] for idx in self.line_ids], dtype=int)
+
+        posts = sorted(posts, key=lambda post: post['point_idx'])
+        self.post_ids = array([post['idx'] for post in posts], dtype=int)
+        self.post_points = array([post['point_idx'] for post in posts], dtype=int)
+        self.types = array([post['type'] for post in posts], dtype=int)
+        self.players = sorted(set(post['player_idx'] for post in posts if post.get('player_idx') is not None) |
+                              set(train['player_idx'] for train in trains))
+        player_index = dict((player, code) for code, player in enumerate(self.players))
+        self.post_players = array([player_index.get(post.get('player_idx'), -1) for post in posts], dtype=int)
+        for name in ('product', 'product_capacity', 'armor', 'armor_capacity', 'replenishment', 'population',
+                     'train_cooldown', 'level'):
+            setattr(self, name, array([post.get(name) or 0 for post in posts], dtype=int))
+        self.towns = full(len(self.players), -1, dtype=int)
+        owned = where((self.types == TOWN) & (self.post_players >= 0))[0]
+        self.towns[self.post_players[owned]] = owned
+
+        trains = sorted(trains, key=lambda train: train['idx'])
+        self.train_ids = array([train['idx'] for train in trains], dtype=int)
+        self.line = array([self.line_index[train['line_idx']] for train in trains], dtype=int)
+        self.position = array([train['position'] for train in trains], dtype=int)
+        self.speed = array([train['speed'] for train in trains], dtype=int)
+        self.goods = array([train['goods'] for train in trains], dtype=int)
+        self.goods_capacity = array([train['goods_capacity'] for train in trains], dtype=int)
+        self.goods_type = array([train['goods_type'] or 0 for train in trains], dtype=int)
+        self.cooldown = array([train['cooldown'] for train in trains], dtype=int)
+        self.train_level = array([train['level'] for train in trains], dtype=int)
+        self.train_players = array([player_index[train['player_idx']] for train in trains], dtype=int)
+
+        self.home_line = full(len(self.players), -1, dtype=int)
+        self.home_position = zeros(len(self.players), dtype=int)
+        for code, town in enumerate(self.towns):
+            if town < 0:
+                continue
+            point = self.post_points[town]
+            column = where((self.starts == point) | (self.ends == point))[0][0]
+            self.home_line[code] = column
+            self.home_position[code] = 0 if self.starts[column] == point else self.lengths[column]
+
+    def move(self, train_idx, line_idx, speed):
+        """Changes line and speed of the train the same way as MOVE request does.
+
+        :param train_idx: int - train index
+        :param line_idx: int - line index
+        :param speed: int - speed value
+        :return: None
+        """
+        row = searchsorted(self.train_ids, train_idx)
+        column = self.line_index[line_idx]
+        if self.cooldown[row]:
+            raise ValueError('The train is under cooldown: {}'.format(train_idx))
+        if column != self.line[row]:
+            point = self.train_point(row)
+            if point not in (self.starts[column], self.ends[column]):
+                raise ValueError('The end of the train\'s line is not connected to the next line')
+            self.line[row] = column
+            self.position[row] = 0 if self.starts[column] == point else self.lengths[column]
+        self.speed[row] = speed
+
+    def train_point(self, row):
+        """Returns index of the point the train of the row stands at or None if the train is between points."""
+        column = self.line[row]
+        if self.position[row] == 0:
+            return self.starts[column]
+        if self.position[row] == self.lengths[column]:
+            return self.ends[column]
+        return None
+
+    def points(self):
+        """Returns points the trains stand at.
+
+        :return: numpy.ndarray - point indexes, -1 for trains between points
+        """
+        lengths = self.lengths[self.line]
+        return where(self.position == 0, self.starts[self.line],
+                     where(self.position == lengths, self.ends[self.line], -1))
+
+    def posts_at(self, points):
+        """Returns rows of posts at the points.
+
+        :param points: numpy.ndarray - point indexes
+        :return: numpy.ndarray - post rows, -1 for points without posts
+        """
+        if not len(self.post_points):
+            return full(len(points), -1, dtype=int)
+        rows = minimum(searchsorted(self.post_points, points), len(self.post_points) - 1)
+        return where(self.post_points[rows] == points, rows, -1)
+
+    def advance(self, ticks=1):
+        """Advances the world.
+
+        :param ticks: int - number of ticks
+        :return: None
+        """
+        for _ in xrange(ticks):
+            self.tick += 1
+            waiting = self.cooldown > 0
+            self.cooldown[waiting] -= 1
+            moving = ~waiting
+            lengths = self.lengths[self.line]
+            self.position = where(moving, clip(self.position + self.speed, 0, lengths), self.position)
+            self.speed[moving & ((self.position == 0) | (self.position == lengths))] = 0
+            self.collide()
+            self.visit()
+            markets, storages = self.types == MARKET, self.types == STORAGE
+            self.product[markets] = minimum(self.product + self.replenishment, self.product_capacity)[markets]
+            self.armor[storages] = minimum(self.armor + self.replenishment, self.armor_capacity)[storages]
+            self.feed()
+
+    def collide(self):
+        """Sends trains standing at the same place out of towns back home with their goods lost."""
+        points = self.points()
+        posts = self.posts_at(points)
+        in_town = (posts >= 0) & (self.types[maximum(posts, 0)] == TOWN)
+        active = where((self.cooldown == 0) & ~in_town)[0]
+        if len(active) < 2:
+            return
+        places = where(points[active] >= 0, points[active],
+                       -1 - (self.line[active] * (self.lengths.max() + 1) + self.position[active]))
+        _, inverse, counts = unique(places, return_inverse=True, return_counts=True)
+        collided = active[counts[inverse] > 1]
+        if not len(collided):
+            return
+        players = self.train_players[collided]
+        self.line[collided] = self.home_line[players]
+        self.position[collided] = self.home_position[players]
+        self.speed[collided], self.goods[collided], self.goods_type[collided] = 0, 0, 0
+        self.cooldown[collided] = self.train_cooldown[self.towns[players]]
+
+    def visit(self):
+        """Loads goods at markets and storages to trains and unloads trains in their towns."""
+        posts = self.posts_at(self.points())
+        active = (self.cooldown == 0) & (posts >= 0)
+        post_types = self.types[maximum(posts, 0)]
+        home = active & (post_types == TOWN) & (self.post_players[maximum(posts, 0)] == self.train_players) & \
+            (self.goods > 0)
+        for goods_type, stock, capacity in ((MARKET, self.product, self.product_capacity),
+                                            (STORAGE, self.armor, self.armor_capacity)):
+            unloading = where(home & (self.goods_type == goods_type))[0]
+            if len(unloading):
+                towns = posts[unloading]
+                add.at(stock, towns, self.goods[unloading])
+                stock[towns] = minimum(stock[towns], capacity[towns])
+            loading = where(active & (post_types == goods_type) & ((self.goods_type == 0) |
+                                                                   (self.goods_type == goods_type)))[0]
+            if len(loading):
+                amount = minimum(self.goods_capacity[loading] - self.goods[loading], stock[posts[loading]])
+                loaded = loading[amount > 0]
+                amount = amount[amount > 0]
+                stock[posts[loaded]] -= amount
+                self.goods[loaded] += amount
+                self.goods_type[loaded] = goods_type
+        self.goods[home], self.goods_type[home] = 0, 0
+
+    def feed(self):
+        """Consumes product of towns by their population. Starving towns lose a citizen."""
+        fed = (self.types == TOWN) & (self.post_players >= 0) & (self.population > 0)
+        self.product[fed] -= self.population[fed]
+        starving = fed & (self.product < 0)
+        self.product[starving] = 0
+        self.population[starving] -= 1
+
+    @property
+    def finished(self):
+        """Returns True if all towns of players have died out."""
+        return bool((self.population[self.towns[self.towns >= 0]] == 0).all())
+
+    def ratings(self):
+        """Returns ratings of players computed the same way as the server does.
+
+        :return: dict - player index to rating
+        """
+        levels = zeros(len(self.players), dtype=int)
+        add.at(levels, self.train_players, self.train_level - 1)
+        ratings = {}
+        for code, player in enumerate(self.players):
+            town = self.towns[code]
+            if town < 0:
+                continue
+            ratings[player] = int(self.population[town] * 1000 + self.product[town] + self.armor[town] +
+                                  (self.level[town] - 1 + levels[code]) * 100)
+        return ratings
+
+    def layer(self):
+        """Returns simulated fields of posts and trains in the form of layer 1.
+
+        :return: dict - 'posts' and 'trains' lists of dicts
+        """
+        posts = [{'idx': int(self.post_ids[row]), 'point_idx': int(self.post_points[row]),
+                  'type': int(self.types[row]), 'product': int(self.product[row]), 'armor': int(self.armor[row]),
+                  'population': int(self.population[row])} for row in arange(len(self.post_ids))]
+        trains = [{'idx': int(self.train_ids[row]), 'line_idx': self.line_ids[self.line[row]],
+                   'position': int(self.position[row]), 'speed': int(self.speed[row]), 'goods': int(self.goods[row]),
+                   'goods_type': int(self.goods_type[row]) or None, 'cooldown': int(self.cooldown[row])}
+                  for row in arange(len(self.train_ids))]
+        return {'posts': posts, 'trains': trains}
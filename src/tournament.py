@@ -0,0 +1,163 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""The module implements tournament runner playing games of headless bots in parallel processes on a local server."""
+from argparse import ArgumentParser
+from json import dumps
+from multiprocessing import Pool, cpu_count
+from sys import exit
+from time import time
+
+from bot import Bot, EventSink
+from server import Server
+from tracing import TickProfiler
+
+
+def play(task):
+    """Plays one game by a headless bot. Runs in a worker process.
+
+    :param task: dict - 'host', 'port', 'game', 'username', 'num_players', 'num_turns' and Bot keyword arguments in
+    'options'
+    :return: dict - game, username, player index, rating, number of ticks, tracing.TickProfiler snapshot and error
+    """
+    profiler = TickProfiler()
+    bot = Bot(queue=EventSink(), profiler=profiler, **task['options'])
+    error = None
+    try:
+        bot.start(host=task['host'], port=task['port'], time_out=task['timeout'], username=task['username'],
+                  game=task['game'], num_players=task['num_players'], num_turns=task['num_turns'])
+    except Exception as exc:
+        error = '{}: {}'.format(type(exc).__name__, exc)
+    finally:
+        bot.close()
+    rating = bot.ratings.get(bot.player_idx, {}).get('rating')
+    return {'game': task['game'], 'username': task['username'], 'player_idx': bot.player_idx, 'rating': rating,
+            'ticks': bot.current_tick, 'profile': profiler.snapshot(), 'error': error}
+
+
+class Tournament(object):
+    """Games of bots played on a local server with bots spread over a pool of processes."""
+
+    def __init__(self, games=1, num_players=1, num_turns=100, processes=None, options=None, **server_options):
+        """Creates tournament.
+
+        :param games: int - number of games
+        :param num_players: int - number of players in a game
+        :param num_turns: int - number of turns of a game
+        :param processes: int - number of bot processes, default is None for number of CPUs; at least num_players
+        processes are started, otherwise games could never gather their players
+        :param options: dict - Bot keyword arguments, e.g. routing or budget
+        :param server_options: server.Server keyword arguments, e.g. map_path, size, tick_interval or latency
+        """
+        self.games, self.num_players, self.num_turns = games, num_players, num_turns
+        self.processes = max(processes or cpu_count(), num_players)
+        self.options = options or {}
+        self.server_options = server_options
+        self.server = None
+
+    def run(self):
+        """Plays all games.
+
+        :return: list - dicts of games results: name, server ticks, ticks per second and results of players with
+        ratings, percentiles of planning and speculative planning times per tick in seconds and missed turns
+        """
+        pool = Pool(processes=self.processes)
+        self.server = Server(('127.0.0.1', 0), **self.server_options)
+        try:
+            host, port = self.server.start()
+            tasks = [{'host': host, 'port': port, 'timeout': max(self.server.tick_interval * 2, 5),
+                      'game': 'tournament-{}'.format(game), 'username': 'bot-{}-{}'.format(game, player),
+                      'num_players': self.num_players, 'num_turns': self.num_turns, 'options': self.options}
+                     for game in xrange(self.games) for player in xrange(self.num_players)]
+            players = pool.map(play, tasks, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+            self.server.shutdown()
+            self.server.server_close()
+        return [self.summary(game, [player for player in players if player['game'] == game])
+                for game in sorted(set(player['game'] for player in players))]
+
+    def summary(self, name, players):
+        """Returns results of the game.
+
+        :param name: string - game name
+        :param players: list - results returned by play for players of the game
+        :return: dict
+        """
+        game = self.server.games.get(name)
+        ticks = game.tick if game is not None else None
+        duration = game.finished_at - game.started_at if game is not None and game.finished_at else None
+        results = []
+        for player in players:
+            phases = player['profile']['phases']
+            planning, speculation = phases.get('plan_turn', {}), phases.get('speculate', {})
+            turns = game.turns.get(player['player_idx'], 0) if game is not None else None
+            results.append({'username': player['username'], 'rating': player['rating'], 'ticks': player['ticks'],
+                            'planning_p50': planning.get('p50'), 'planning_p99': planning.get('p99'),
+                            'speculation_p50': speculation.get('p50'), 'speculation_p99': speculation.get('p99'),
+                            'missed': ticks - turns if ticks is not None else None, 'error': player['error']})
+        return {'game': name, 'ticks': ticks, 'ticks_per_second': ticks / duration if duration else None,
+                'players': results}
+
+
+def milliseconds(value):
+    """Formats duration in seconds as milliseconds, '-' for None."""
+    return '{:.2f} ms'.format(value * 1000) if value is not None else '-'
+
+
+def report(games):
+    """Formats tournament results as text. Planning is the time between receiving the map and sending the turn,
+    speculation is planning of the next turn while the turn request is in flight.
+
+    :param games: list - games results returned by Tournament.run
+    :return: string
+    """
+    lines = []
+    for game in games:
+        speed = '{:.1f}'.format(game['ticks_per_second']) if game['ticks_per_second'] else '-'
+        lines.append('{}: {} ticks, {} ticks/s'.format(game['game'], game['ticks'], speed))
+        for player in game['players']:
+            lines.append('  {}: rating {}, planning p50 {} p99 {}, speculation p50 {} p99 {}, missed turns {}{}'.format(
+                player['username'], player['rating'], milliseconds(player['planning_p50']),
+                milliseconds(player['planning_p99']), milliseconds(player['speculation_p50']),
+                milliseconds(player['speculation_p99']), player['missed'],
+                ', error {}'.format(player['error']) if player['error'] else ''))
+    return '\n'.join(lines)
+
+
+def main():
+    """Parses command line arguments, plays the tournament and prints results. Exits with status 1 if any bot failed,
+    so a tournament can be used as a regression game."""
+    parser = ArgumentParser(description='Plays games of headless bots in parallel processes on a local server.')
+    parser.add_argument('--games', type=int, default=1, help='number of games')
+    parser.add_argument('--players', type=int, default=1, help='number of players in a game')
+    parser.add_argument('--turns', type=int, default=100, help='number of turns of a game')
+    parser.add_argument('--processes', type=int, help='number of bot processes, default is number of CPUs')
+    parser.add_argument('--map', dest='map_path', help='path to *.json map file, e.g. ../test_graphs/big_graph.json')
+    parser.add_argument('--size', type=int, default=10, help='side of a generated grid map')
+    parser.add_argument('--tick', type=float, default=10, help='maximal turn duration in seconds')
+    parser.add_argument('--latency', type=float, default=0, help='round trip time in seconds')
+    parser.add_argument('--no-events', dest='events', action='store_false')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--routing', choices=sorted(Bot.ROUTING), help='routing preprocessing of bots')
+    parser.add_argument('--budget', type=float, help='planning seconds per tick of bots')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+    options = dict((name, value) for name, value in (('routing', args.routing), ('budget', args.budget))
+                   if value is not None)
+    tournament = Tournament(games=args.games, num_players=args.players, num_turns=args.turns,
+                            processes=args.processes, options=options, map_path=args.map_path, size=args.size,
+                            tick_interval=args.tick, latency=args.latency, events=args.events, seed=args.seed)
+    started = time()
+    games = tournament.run()
+    if args.json:
+        print dumps(games, indent=2)
+    else:
+        print report(games)
+        print 'Played {} games in {:.1f} s'.format(len(games), time() - started)
+    if any(player['error'] for game in games for player in game['players']):
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""The module implements fixed-size latency histograms, per action statistics of client requests and tick profiling."""
+import sys
+from collections import deque
+from os.path import basename
+from threading import Lock, Thread, current_thread
+from time import sleep, time
+
+
+class Histogram(object):
+    """Histogram of durations in microseconds with fixed log-linear buckets up to 2 ** POWERS microseconds.
+
+    Durations below STEPS microseconds have a bucket per microsecond, and every power of two range above is split into
+    STEPS linear buckets, so a bucket is at most 1 / STEPS of its lower bound wide and percentiles interpolated within
+    a bucket are off by less than that.
+    """
+    STEPS_BITS = 3
+    STEPS = 1 << STEPS_BITS
+    POWERS = 26
+    BUCKETS = STEPS * (POWERS - STEPS_BITS + 1)
+
+    def __init__(self):
+        """Creates an empty histogram."""
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def bucket(cls, microseconds):
+        """Returns bucket of the duration.
+
+        :param microseconds: int - duration in microseconds
+        :return: int - bucket index
+        """
+        if microseconds < cls.STEPS:
+            return microseconds
+        shift = microseconds.bit_length() - 1 - cls.STEPS_BITS
+        return min(cls.STEPS * (shift + 1) + (microseconds >> shift) - cls.STEPS, cls.BUCKETS - 1)
+
+    @classmethod
+    def bounds(cls, bucket):
+        """Returns range of durations of the bucket.
+
+        :param bucket: int - bucket index
+        :return: tuple - 2-tuple: lower and upper bounds in seconds
+        """
+        if bucket < cls.STEPS:
+            return bucket / 1000000.0, (bucket + 1) / 1000000.0
+        shift, step = bucket // cls.STEPS - 1, cls.STEPS + bucket % cls.STEPS
+        return (step << shift) / 1000000.0, (step + 1 << shift) / 1000000.0
+
+    def add(self, value):
+        """Adds a duration.
+
+        :param value: float - duration in seconds
+        :return: None
+        """
+        self.counts[self.bucket(int(value * 1000000))] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None or value < self.min else self.min
+        self.max = value if self.max is None or value > self.max else self.max
+
+    def percentile(self, percent):
+        """Returns the percentile estimated by linear interpolation within the bucket containing it.
+
+        :param percent: float - percentile from 0 to 100
+        :return: float - duration in seconds or None if the histogram is empty
+        """
+        if not self.count:
+            return None
+        rank, accumulated = percent / 100.0 * self.count, 0
+        for bucket, count in enumerate(self.counts):
+            if count and accumulated + count >= rank:
+                lower, upper = self.bounds(bucket)
+                value = lower + (upper - lower) * (rank - accumulated) / count
+                return min(max(value, self.min), self.max)
+            accumulated += count
+        return self.max
+
+    def snapshot(self):
+        """Returns histogram summary.
+
+        :return: dict - count, mean, min, max, p50, p90, p99 and bucket counts
+        """
+        return {'count': self.count, 'mean': self.total / self.count if self.count else None, 'min': self.min,
+                'max': self.max, 'p50': self.percentile(50), 'p90': self.percentile(90),
+                'p99': self.percentile(99), 'buckets': list(self.counts)}
+
+
+class ActionStats(object):
+    """Statistics of requests of one action."""
+
+    def __init__(self):
+        """Creates empty statistics."""
+        self.latency = Histogram()
+        self.decode = Histogram()
+        self.sent = 0
+        self.received = 0
+        self.errors = {}
+
+    def snapshot(self):
+        """Returns statistics summary.
+
+        :return: dict
+        """
+        return {'latency': self.latency.snapshot(), 'decode': self.decode.snapshot(), 'sent': self.sent,
+                'received': self.received, 'errors': dict(self.errors)}
+
+
+class Tracer(object):
+    """Collects per action statistics of client requests. Actions are keyed by name, MAP requests by layer too."""
+
+    def __init__(self):
+        """Creates tracer."""
+        self.lock = Lock()
+        self.actions = {}
+
+    def get(self, key):
+        """Returns statistics of the action creating them if needed.
+
+        :param key: string - action key, e.g. 'TURN' or 'MAP:1'
+        :return: ActionStats instance
+        """
+        stats = self.actions.get(key)
+        if stats is None:
+            stats = self.actions.setdefault(key, ActionStats())
+        return stats
+
+    def request(self, key, size):
+        """Records a sent request.
+
+        :param key: string - action key
+        :param size: int - request size in bytes
+        :return: None
+        """
+        stats = self.get(key)
+        with self.lock:
+            stats.sent += size
+
+    def response(self, key, latency, size, status):
+        """Records a received response.
+
+        :param key: string - action key
+        :param latency: float - time in seconds from sending the request to receiving the whole response
+        :param size: int - response size in bytes
+        :param status: string - response status
+        :return: None
+        """
+        stats = self.get(key)
+        with self.lock:
+            stats.latency.add(latency)
+            stats.received += size
+            if status != 'OK':
+                stats.errors[status] = stats.errors.get(status, 0) + 1
+
+    def decoded(self, key, duration):
+        """Records response body decoding time.
+
+        :param key: string - action key
+        :param duration: float - decoding time in seconds
+        :return: None
+        """
+        stats = self.get(key)
+        with self.lock:
+            stats.decode.add(duration)
+
+    def snapshot(self, reset=False):
+        """Returns statistics of all actions.
+
+        :param reset: bool - clears statistics after taking the snapshot when True
+        :return: dict - action key to statistics summary
+        """
+        with self.lock:
+            actions = self.actions
+            if reset:
+                self.actions = {}
+        return dict((key, stats.snapshot()) for key, stats in actions.items())
+
+    def reset(self):
+        """Clears statistics."""
+        with self.lock:
+            self.actions = {}
+
+
+class TickProfiler(object):
+    """Durations of phases of bot ticks and counters of expensive operations.
+
+    Phases are timed inclusively, so a phase called from another one counts in both of them. Optionally a sampling
+    thread takes stacks of the profiled thread during ticks, and stacks of ticks longer than the threshold are kept
+    and written to the stream.
+    """
+    SLOW_TICKS = 50
+
+    def __init__(self, threshold=None, interval=0.001, top=5, depth=8, stream=None):
+        """Creates profiler.
+
+        :param threshold: float - tick duration in seconds above which hot stacks are dumped, default is None for no
+        sampling
+        :param interval: float - sampling interval in seconds
+        :param top: int - number of the hottest stacks dumped
+        :param depth: int - number of innermost frames of sampled stacks
+        :param stream: file - stream stacks are written to, default is None for sys.stderr
+        """
+        self.threshold, self.interval, self.top, self.depth = threshold, interval, top, depth
+        self.stream = stream
+        self.lock = Lock()
+        self.ticks = Histogram()
+        self.phases, self.counters = {}, {}
+        self.tick, self.started = None, None
+        self.current, self.counts = {}, {}
+        self.slow = deque(maxlen=self.SLOW_TICKS)
+        self.samples = {}
+        self.thread_id = None
+        self.sampler = None
+
+    def start_tick(self, tick):
+        """Starts timing of the tick on the calling thread.
+
+        :param tick: int - tick number
+        :return: None
+        """
+        self.tick, self.current, self.counts = tick, {}, {}
+        if self.threshold is not None:
+            with self.lock:
+                self.samples = {}
+                self.thread_id = current_thread().ident
+            if self.sampler is None:
+                self.sampler = Thread(target=self.sample)
+                self.sampler.daemon = True
+                self.sampler.start()
+        self.started = time()
+
+    def measure(self, phase, duration):
+        """Adds duration of the phase to the current tick.
+
+        :param phase: string - phase name
+        :param duration: float - duration in seconds
+        :return: None
+        """
+        self.current[phase] = self.current.get(phase, 0.0) + duration
+
+    def count(self, name, value=1):
+        """Increments the counter in the current tick.
+
+        :param name: string - counter name
+        :param value: int - increment
+        :return: None
+        """
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def end_tick(self):
+        """Finishes timing of the current tick. Keeps and dumps hot stacks if the tick is longer than the threshold.
+
+        :return: float - tick duration in seconds or None if no tick is started
+        """
+        if self.started is None:
+            return None
+        duration, self.started = time() - self.started, None
+        with self.lock:
+            self.thread_id = None
+            samples, self.samples = self.samples, {}
+        self.ticks.add(duration)
+        for phase, value in self.current.items():
+            self.phases.setdefault(phase, Histogram()).add(value)
+        for name, value in self.counts.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        if self.threshold is not None and duration > self.threshold:
+            stacks = sorted(samples.items(), key=lambda item: -item[1])[:self.top]
+            self.slow.append({'tick': self.tick, 'duration': duration, 'phases': dict(self.current),
+                              'counts': dict(self.counts), 'stacks': stacks})
+            self.dump(self.slow[-1])
+        return duration
+
+    def sample(self):
+        """Takes stacks of the profiled thread while a tick is timed. Runs in the sampling thread.
+
+        Frames of decorator wrappers are skipped, so stacks show only the decorated functions.
+        """
+        while self.sampler is not None:
+            sleep(self.interval)
+            with self.lock:
+                if self.thread_id is None:
+                    continue
+                frame = sys._current_frames().get(self.thread_id)
+                stack = []
+                while frame is not None and len(stack) < self.depth:
+                    if frame.f_code.co_name == 'wrapped':
+                        frame = frame.f_back
+                        continue
+                    stack.append('{}:{} {}'.format(basename(frame.f_code.co_filename), frame.f_lineno,
+                                                   frame.f_code.co_name))
+                    frame = frame.f_back
+                stack = tuple(stack)
+                self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def close(self):
+        """Stops the sampling thread."""
+        sampler, self.sampler = self.sampler, None
+        if sampler is not None:
+            sampler.join()
+
+    def dump(self, slow):
+        """Writes the slow tick with its phases, counters and hot stacks to the stream.
+
+        :param slow: dict - slow tick kept by end_tick
+        :return: None
+        """
+        stream = self.stream if self.stream is not None else sys.stderr
+        phases = ', '.join('{} {:.1f} ms'.format(phase, value * 1000) for phase, value in
+                           sorted(slow['phases'].items(), key=lambda item: -item[1]))
+        counts = ', '.join('{} {}'.format(name, value) for name, value in sorted(slow['counts'].items()))
+        lines = ['Tick {} took {:.1f} ms: {}{}'.format(slow['tick'], slow['duration'] * 1000, phases,
+                                                       '; ' + counts if counts else '')]
+        for stack, samples in slow['stacks']:
+            lines.append('  {} samples:'.format(samples))
+            lines.extend('    {}'.format(frame) for frame in stack)
+        stream.write('\n'.join(lines) + '\n')
+
+    def snapshot(self, reset=False):
+        """Returns statistics of ticks.
+
+        :param reset: bool - clears statistics after taking the snapshot when True
+        :return: dict - 'ticks' and 'phases' duration summaries, 'counters' totals and 'slow' ticks
+        """
+        snapshot = {'ticks': self.ticks.snapshot(),
+                    'phases': dict((phase, histogram.snapshot()) for phase, histogram in self.phases.items()),
+                    'counters': dict(self.counters), 'slow': list(self.slow)}
+        if reset:
+            self.ticks, self.phases, self.counters = Histogram(), {}, {}
+            self.slow.clear()
+        return snapshot
@@ -0,0 +1,355 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""The module implements game world state updated in place from dynamic layer changes."""
+
+
+class Record(object):
+    """Game object with fields in slots and names of fields changed by the last update.
+
+    Fields are accessible both as attributes and as items, so records can replace decoded JSON dicts. Fields missing
+    from FIELDS are kept in the extra dict.
+    """
+    __slots__ = ('extra', 'dirty')
+    FIELDS = ()
+
+    def __init__(self, fields):
+        """Creates record. All fields are marked as changed.
+
+        :param fields: dict - decoded object
+        """
+        self.extra = {}
+        for name in self.FIELDS:
+            setattr(self, name, None)
+        self.dirty = set()
+        self.update(fields)
+
+    def __getitem__(self, name):
+        """Returns field value."""
+        if name in self.extra:
+            return self.extra[name]
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        """Assigns field value and marks the field as changed."""
+        if name in self.FIELDS:
+            setattr(self, name, value)
+        else:
+            self.extra[name] = value
+        self.dirty.add(name)
+
+    def __contains__(self, name):
+        """Returns True if the record has the field."""
+        return name in self.FIELDS or name in self.extra
+
+    def get(self, name, default=None):
+        """Returns field value or default if the record has no such field."""
+        return self[name] if name in self else default
+
+    def update(self, fields):
+        """Assigns values of fields which differ from the current ones and marks them as changed.
+
+        :param fields: dict - field name to value
+        :return: None
+        """
+        for name, value in fields.items():
+            if name not in self or self[name] != value:
+                self[name] = value
+
+    def clean(self):
+        """Clears change marks."""
+        self.dirty.clear()
+
+
+class Post(Record):
+    """Town, market or storage."""
+    FIELDS = ('idx', 'name', 'type', 'point_idx', 'player_idx', 'events', 'level', 'population', 'population_capacity',
+              'product', 'product_capacity', 'armor', 'armor_capacity', 'replenishment', 'train_cooldown',
+              'next_level_price')
+    __slots__ = FIELDS
+
+
+class Train(Record):
+    """Train of a player."""
+    FIELDS = ('idx', 'player_idx', 'line_idx', 'position', 'speed', 'goods', 'goods_type', 'goods_capacity', 'level',
+              'cooldown', 'events', 'next_level_price')
+    __slots__ = FIELDS
+
+
+class World(object):
+    """Posts and trains updated in place from client.DynamicLayer deltas.
+
+    Posts are keyed by point index as the bot addresses them and trains by train index. Indexes of posts by type and
+    of trains by player are kept up to date, and the sets of objects added, changed or removed by the last update let
+    planners process only them instead of rescanning the world.
+    """
+
+    def __init__(self):
+        """Creates empty world."""
+        self.posts, self.trains, self.post_points = {}, {}, {}
+        self.posts_by_type, self.trains_by_player = {}, {}
+        self.changed_posts, self.removed_posts = set(), set()
+        self.changed_trains, self.removed_trains = set(), set()
+
+    def clear(self):
+        """Removes all objects keeping the dicts, so references to them stay valid."""
+        for collection in (self.posts, self.trains, self.post_points, self.posts_by_type, self.trains_by_player):
+            collection.clear()
+        self.clean()
+
+    def clean(self):
+        """Forgets changes of the last update."""
+        for idx in self.changed_posts:
+            if idx in self.posts:
+                self.posts[idx].clean()
+        for idx in self.changed_trains:
+            if idx in self.trains:
+                self.trains[idx].clean()
+        for changes in (self.changed_posts, self.removed_posts, self.changed_trains, self.removed_trains):
+            changes.clear()
+
+    def apply(self, delta):
+        """Applies changes of dynamic objects.
+
+        :param delta: dict - changes of dynamic objects computed by client.DynamicLayer
+        :return: None
+        """
+        self.clean()
+        posts, trains = delta['posts'], delta['trains']
+        for post in posts['added'].values():
+            self.remove_post(self.post_points.get(post['idx']))
+            record = self.posts[post['point_idx']] = Post(post)
+            self.post_points[record.idx] = record.point_idx
+            self.posts_by_type.setdefault(record.type, set()).add(record.point_idx)
+            self.changed_posts.add(record.point_idx)
+        for idx, fields in posts['changed'].items():
+            point_idx = self.post_points[idx]
+            self.posts[point_idx].update(fields)
+            self.changed_posts.add(point_idx)
+        for idx in posts['removed']:
+            self.remove_post(self.post_points.get(idx))
+        for train in trains['added'].values():
+            self.remove_train(train['idx'])
+            record = self.trains[train['idx']] = Train(train)
+            self.trains_by_player.setdefault(record.player_idx, set()).add(record.idx)
+            self.changed_trains.add(record.idx)
+        for idx, fields in trains['changed'].items():
+            record = self.trains[idx]
+            if 'player_idx' in fields and fields['player_idx'] != record.player_idx:
+                self.trains_by_player[record.player_idx].discard(idx)
+                self.trains_by_player.setdefault(fields['player_idx'], set()).add(idx)
+            record.update(fields)
+            self.changed_trains.add(idx)
+        for idx in trains['removed']:
+            self.remove_train(idx)
+
+    def remove_post(self, point_idx):
+        """Removes post from the world and indexes.
+
+        :param point_idx: int - point index of the post, None is ignored
+        :return: None
+        """
+        record = self.posts.pop(point_idx, None)
+        if record is not None:
+            self.post_points.pop(record.idx, None)
+            self.posts_by_type[record.type].discard(point_idx)
+            self.changed_posts.discard(point_idx)
+            self.removed_posts.add(point_idx)
+
+    def remove_train(self, idx):
+        """Removes train from the world and indexes.
+
+        :param idx: int - train index
+        :return: None
+        """
+        record = self.trains.pop(idx, None)
+        if record is not None:
+            self.trains_by_player[record.player_idx].discard(idx)
+            self.changed_trains.discard(idx)
+            self.removed_trains.add(idx)
+
+    def player_trains(self, player_idx):
+        """Returns trains of the player in order of their indexes.
+
+        :param player_idx: string - player index
+        :return: list - Train instances
+        """
+        return [self.trains[idx] for idx in sorted(self.trains_by_player.get(player_idx, ()))]
+
+    def town(self, player_idx):
+        """Returns town of the player.
+
+        :param player_idx: string - player index
+        :return: Post instance or None
+        """
+        for point_idx in self.posts_by_type.get(1, ()):
+            if self.posts[point_idx].player_idx == player_idx:
+                return self.posts[point_idx]
+        return None
+
+
+class Slots(object):
+    """Trains placed on positions of lines and on points at one tick."""
+
+    def __init__(self):
+        """Creates empty table."""
+        self.lines, self.points, self.trains = {}, {}, {}
+
+    def place(self, idx, slot):
+        """Places train to the slot removing it from the previous one.
+
+        :param idx: int - train index
+        :param slot: tuple - 3-tuple: line index, position within the line and point index if the position is an end
+        of the line or None otherwise, None places the train nowhere
+        :return: None
+        """
+        self.remove(idx)
+        if slot is not None:
+            line_idx, position, point = slot
+            self.lines.setdefault(line_idx, {}).setdefault(position, set()).add(idx)
+            if point is not None:
+                self.points.setdefault(point, set()).add(idx)
+        self.trains[idx] = slot
+
+    def remove(self, idx):
+        """Removes train from the table.
+
+        :param idx: int - train index
+        :return: None
+        """
+        slot = self.trains.pop(idx, None)
+        if slot is not None:
+            line_idx, position, point = slot
+            self.discard(self.lines[line_idx], position, idx)
+            if not self.lines[line_idx]:
+                del self.lines[line_idx]
+            if point is not None:
+                self.discard(self.points, point, idx)
+
+    @staticmethod
+    def discard(table, key, idx):
+        """Removes train from the set of the key dropping the set when it gets empty."""
+        table[key].discard(idx)
+        if not table[key]:
+            del table[key]
+
+    @staticmethod
+    def busy(trains, idx):
+        """Returns True if the set of trains has a train other than the given one."""
+        return bool(trains) and (len(trains) > 1 or idx not in trains)
+
+
+class Occupancy(object):
+    """Index of positions occupied by trains answering whether a position is free in constant time.
+
+    Trains occupy their positions within lines, and trains at the ends of lines also occupy the points, so a train
+    standing at a point blocks it for trains coming by any line. Trains in towns occupy nothing. Besides positions of
+    the next tick trains can reserve positions several ticks ahead.
+    """
+
+    def __init__(self, lines, towns=()):
+        """Creates empty index.
+
+        :param lines: dict - line index to line attributes, the dict may be filled later
+        :param towns: set - points of towns where trains don't collide
+        """
+        self.lines = lines
+        self.towns = towns
+        self.current = Slots()
+        self.reserved = {}
+
+    def clear(self):
+        """Removes all trains and reservations."""
+        self.current = Slots()
+        self.reserved = {}
+
+    def slot(self, line_idx, position):
+        """Returns slot of the position or None if the position is in a town.
+
+        :param line_idx: int - line index
+        :param position: int - position within the line
+        :return: tuple - 3-tuple: line index, position and point index if the position is an end of the line or None
+        otherwise
+        """
+        line = self.lines[line_idx]
+        if position == 0 or position == line['length']:
+            point = line['points'][0] if position == 0 else line['points'][1]
+            return (line_idx, position, point) if point not in self.towns else None
+        return line_idx, position, None
+
+    def __contains__(self, idx):
+        """Returns True if the train is placed."""
+        return idx in self.current.trains
+
+    def place(self, idx, line_idx, position):
+        """Places train to the position of the next tick.
+
+        :param idx: int - train index
+        :param line_idx: int - line index
+        :param position: int - position within the line
+        :return: None
+        """
+        self.current.place(idx, self.slot(line_idx, position))
+
+    def reserve(self, idx, tick, line_idx, position):
+        """Reserves the position at the tick for the train replacing its previous reservation of the tick.
+
+        :param idx: int - train index
+        :param tick: int - tick number
+        :param line_idx: int - line index
+        :param position: int - position within the line
+        :return: None
+        """
+        self.reserved.setdefault(tick, Slots()).place(idx, self.slot(line_idx, position))
+
+    def release(self, tick):
+        """Drops reservations of ticks up to the tick.
+
+        :param tick: int - tick number
+        :return: None
+        """
+        for reserved_tick in [reserved_tick for reserved_tick in self.reserved if reserved_tick <= tick]:
+            del self.reserved[reserved_tick]
+
+    def cancel(self, idx):
+        """Drops reservations of the train, e.g. before it reserves positions of a new route.
+
+        :param idx: int - train index
+        :return: None
+        """
+        for slots in self.reserved.values():
+            slots.remove(idx)
+
+    def remove(self, idx):
+        """Removes train and its reservations.
+
+        :param idx: int - train index
+        :return: None
+        """
+        self.current.remove(idx)
+        self.cancel(idx)
+
+    def line_busy(self, line_idx, position, idx=None, tick=None):
+        """Returns True if another train occupies the position within the line.
+
+        :param line_idx: int - line index
+        :param position: int - position within the line
+        :param idx: int - train index to be ignored, default is None
+        :param tick: int - tick of reservations to be checked, default is None checking positions of the next tick
+        :return: bool
+        """
+        slots = self.current if tick is None else self.reserved.get(tick)
+        return slots is not None and Slots.busy(slots.lines.get(line_idx, {}).get(position), idx)
+
+    def point_busy(self, point, idx=None, tick=None):
+        """Returns True if another train occupies the point.
+
+        :param point: int - point index
+        :param idx: int - train index to be ignored, default is None
+        :param tick: int - tick of reservations to be checked, default is None checking positions of the next tick
+        :return: bool
+        """
+        slots = self.current if tick is None else self.reserved.get(tick)
+        return slots is not None and Slots.busy(slots.points.get(point), idx)